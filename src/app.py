@@ -1,11 +1,17 @@
 import streamlit as st
-from llm_utils import stream_ollama, query_ollama
-from memory import save_message, retrieve_memory, get_memory_stats, get_all_messages, summarize_and_compact, clear_all_memory, delete_message_by_id, pin_message, unpin_message, get_pinned_messages, push_working_goal, list_working_goals, forget_by_text
-from persona import generate_adaptive_prompt, detect_sentiment, load_persona_config
+from llm_utils import stream_chat, MODEL, PERSONA_MODEL
+from memory import save_messages, retrieve_memory, get_memory_stats, get_memory_overview, get_all_messages, clear_all_memory, delete_message_by_id, pin_message, unpin_message, get_pinned_messages, get_pinned_count, push_working_goal, list_working_goals, forget_by_text, warmup_memory, set_namespace, SESSION_PREFIX, MEMORY_CONFIG
+from compaction import MANUAL_LIMIT, request_compaction, get_compaction_status
+from stream_render import StreamRenderer
+from context import ContextAssembler, PINNED_IN_PROMPT
+from short_term import ShortTermMemory, DEFAULT_WINDOW, is_follow_up
+import metrics
+from persona import detect_sentiment, get_persona_engine, load_persona_config
 import datetime
 import json
 import time
 import re
+import uuid
 from pathlib import Path
 
 # Resolve project root (one level up from src)
@@ -13,6 +19,15 @@ ROOT_PATH = Path(__file__).resolve().parent.parent
 
 st.set_page_config(page_title="FRIDAY Bot", page_icon="🤖", layout="wide")
 
+
+# Load the embedding model + vector store once per server process, off the script thread
+@st.cache_resource(show_spinner=False)
+def start_memory_warmup():
+    return warmup_memory(background=True)
+
+
+start_memory_warmup()
+
 # Global styles and subtle AI-themed effects (mobile-friendly)
 def inject_global_styles():
     st.markdown(
@@ -99,10 +114,54 @@ def load_preferences():
     except FileNotFoundError:
         return {
             "tone_weight": {"motivational": 0.9, "comedy": 0.6, "directness": 1.0},
-            "ui_preferences": {"personality_toggle": 0.5, "show_memory_tags": True, "show_latency_monitor": True}
+            "ui_preferences": {"personality_toggle": 0.5, "show_memory_tags": True, "show_latency_monitor": True,
+                               "save_metrics": False}
         }
 
 preferences = load_preferences()
+# Per-turn timings go to src/metrics.jsonl (rotated) only when enabled in Settings
+metrics.METRICS_PATH = metrics.DEFAULT_METRICS_PATH if preferences["ui_preferences"].get("save_metrics") else None
+
+
+def bind_memory_namespace() -> str:
+    """Route this session's memory calls: working goals are always per browser
+    session; long-term memory follows memory_config `isolation`:
+    shared (one store), user (?user=<name> in the URL, shared if absent) or session."""
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex[:12]
+    mode = MEMORY_CONFIG.get("isolation", "user")
+    if mode == "session":
+        namespace = SESSION_PREFIX + st.session_state.session_id
+    elif mode == "user":
+        namespace = st.query_params.get("user", "")
+    else:
+        namespace = ""
+    set_namespace(namespace, session=st.session_state.session_id)
+    return namespace
+
+memory_namespace = bind_memory_namespace()
+
+
+def latency_panel(turn_metrics):
+    """Per-stage breakdown of one chat turn (spans + Ollama generation timing)."""
+    gen = turn_metrics.get("generation", {})
+    with st.expander("⏱️ Latency breakdown", expanded=False):
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("Time to first token", f"{gen.get('ttft_ms', 0):.0f} ms")
+        c2.metric("Tokens/sec", f"{gen.get('eval_tokens_per_sec', gen.get('tokens_per_sec', 0)):.1f}")
+        c3.metric("Prompt eval", f"{gen.get('prompt_eval_ms', 0):.0f} ms")
+        c4.metric("Inter-token (mean)", f"{gen.get('itl_mean_ms', 0):.0f} ms")
+        context = turn_metrics.get("context", {})
+        if context:
+            st.caption(f"Prompt context: {context['tokens']} / {context['budget']} tokens"
+                       + (f" · trimmed {context['dropped']}" if context["dropped"] else "")
+                       + (f" · {context['overflow']} over budget" if context.get("overflow") else ""))
+        stages = {name: f"{ms:.1f} ms" for name, ms in turn_metrics.get("spans", {}).items()}
+        stages["total"] = f"{turn_metrics.get('total_ms', 0):.1f} ms"
+        st.json({"stages": stages, "generation": gen, "context": context})
+
+# Memory counts for this rerun (one cached call shared by every panel)
+memory_overview = get_memory_overview()
 
 # Create tabs for different sections
 tab1, tab2, tab3 = st.tabs(["💬 Chat", "🧠 Memory Analysis", "⚙️ Settings"])
@@ -112,8 +171,7 @@ with tab1:
     # Sidebar for chat controls
     with st.sidebar:
         st.header("💬 Chat Controls")
-        memory_count = get_memory_stats()
-        st.metric("📊 Total Messages", memory_count)
+        st.metric("📊 Total Messages", memory_overview["total"])
         
         # Memory toggle
         use_memory = st.checkbox("Use Memory Context", value=True, help="Enable/disable memory retrieval")
@@ -134,9 +192,8 @@ with tab1:
         
         with col2:
             if st.button("🧹 Compact Memory"):
-                with st.spinner("Compacting memory..."):
-                    summarize_and_compact()
-                st.success("Memory compacted!")
+                request_compaction(force=True, limit=MANUAL_LIMIT)
+                st.success("Compaction started in the background.")
         
         # Password verification for memory clearing
         if st.session_state.get('show_clear_password', False):
@@ -150,6 +207,7 @@ with tab1:
                             if clear_all_memory():
                                 st.success("All memory cleared!")
                                 st.session_state.messages = []  # Clear session too
+                                st.session_state.pop("short_term", None)
                                 st.session_state.show_clear_password = False
                                 st.rerun()
                             else:
@@ -162,7 +220,7 @@ with tab1:
                     st.rerun()
         
         # Show pinned messages count
-        pinned_count = len(get_pinned_messages())
+        pinned_count = memory_overview["pinned"]
         if pinned_count > 0:
             st.info(f"📌 {pinned_count} pinned messages")
         
@@ -173,6 +231,12 @@ with tab1:
         # Session state for chat history
         if "messages" not in st.session_state:
             st.session_state.messages = []
+        # Recent turns fed straight into the prompt (no vector search needed)
+        short_term_window = preferences.get("memory_retention", {}).get("short_term", DEFAULT_WINDOW)
+        if "short_term" not in st.session_state:
+            st.session_state.short_term = ShortTermMemory(short_term_window)
+        short_term = st.session_state.short_term
+        short_term.resize(short_term_window)
 
         # Display chat history
         for chat in st.session_state.messages:
@@ -226,7 +290,7 @@ with tab1:
                 with st.chat_message("assistant"):
                     start_time = time.time()
                     
-                    with st.spinner("Thinking..."):
+                    with st.spinner("Thinking..."), metrics.turn() as turn_metrics:
                         # Detect sentiment and store in session
                         sentiment = detect_sentiment(prompt)
                         st.session_state.last_sentiment = sentiment
@@ -235,58 +299,93 @@ with tab1:
                         if re.search(r"\b(my goal|new goal|objective|plan to|i want to)\b", prompt, re.I):
                             push_working_goal(prompt)
                         
+                        memory_lines, pinned_lines, goal_lines = [], [], []
+                        history = short_term.messages()
+                        # Follow-ups are answered from the short-term window alone
+                        follow_up = bool(history) and is_follow_up(
+                            prompt, " ".join(m["content"] for m in history))
+                        turn_metrics["follow_up"] = follow_up
                         if use_memory:
                             # Retrieve relevant past context (limit to 2-3 items)
-                            memories = retrieve_memory(prompt, top_k=2)
-                            context_lines = [f"{m['role']}: {m['content']}" for m in memories]
+                            if not follow_up:
+                                memories = retrieve_memory(prompt, top_k=2)
+                                memory_lines = [f"{m['role']}: {m['content']}" for m in memories]
+                            # Explicitly pinned facts, newest first
+                            if get_pinned_count() > 0:
+                                pinned = sorted(get_pinned_messages(), key=lambda m: m['timestamp'], reverse=True)
+                                pinned_lines = [f"- {m['content']}" for m in pinned[:PINNED_IN_PROMPT]]
                             # Include working goals in context
-                            goals = list_working_goals()
-                            if goals:
-                                context_lines.append("Working goals: " + "; ".join(goals))
-                            context_block = "\n".join(context_lines) if context_lines else "—"
-                        else:
-                            context_block = "—"
+                            goal_lines = [f"- {g}" for g in list_working_goals()]
                         
                         # Generate adaptive prompt based on sentiment and personality
-                        persona_config = load_persona_config(root_path=ROOT_PATH)
-                        base_prompt = generate_adaptive_prompt(prompt, persona_config)
+                        with metrics.span("generate_adaptive_prompt"):
+                            persona_engine = get_persona_engine(ROOT_PATH)
+                            turn_instructions = persona_engine.turn_instructions(prompt, sentiment)
                         
                         # Adjust based on personality toggle
                         if personality_toggle > 0.7:
-                            base_prompt += "\n- Add more humor and casual tone"
+                            turn_instructions += "\n- Add more humor and casual tone"
                         elif personality_toggle < 0.3:
-                            base_prompt += "\n- Be more direct and professional"
+                            turn_instructions += "\n- Be more direct and professional"
                         
-                        # Build final prompt
-                        final_prompt = f"""{base_prompt}
-
-Relevant memory:
-{context_block}
-
-Team (Exynos Thinkers): {prompt}
-Assistant:"""
+                        # Fit every section into num_ctx; the least important lose lines
+                        # first (older summary, memory, pinned facts, oldest history, goals).
+                        assembler = ContextAssembler()
+                        if not PERSONA_MODEL:
+                            assembler.add("persona", [persona_engine.system_prompt()], priority=0, required=True)
+                        assembler.add("instructions", [turn_instructions], priority=0, required=True)
+                        assembler.add("goals", goal_lines, priority=1, title="Working goals:", max_tokens=200)
+                        assembler.add("history", [f"{m['role']}: {m['content']}" for m in history],
+                                      priority=2, max_tokens=1200, drop_from="start")
+                        assembler.add("pinned", pinned_lines, priority=3, title="Pinned facts:", max_tokens=400)
+                        assembler.add("memory", memory_lines, priority=4, title="Relevant memory:", max_tokens=800)
+                        assembler.add("earlier", [short_term.summary], priority=5,
+                                      title="Earlier in this conversation:", max_tokens=250)
+                        assembler.add("question", [f"Team (Exynos Thinkers): {prompt}"], priority=0, required=True)
+                        turn_metrics["context"] = assembler.build()
                         
-                        # Stream the response for better UX
-                        placeholder = st.empty()
-                        buf = []
-                        for tok in stream_ollama(final_prompt):
-                            buf.append(tok)
-                            placeholder.markdown("".join(buf))
-                        response = "".join(buf)
+                        # Build chat messages: the persona system message never changes
+                        # between turns, so Ollama reuses its cached prefix; recent turns
+                        # follow it and everything turn-specific goes in the final user message.
+                        chat_messages = []
+                        if not PERSONA_MODEL:
+                            chat_messages.append({"role": "system", "content": assembler.render(["persona"])})
+                        for line in assembler.sections["history"].lines:
+                            role, _, content = line.partition(": ")
+                            chat_messages.append({"role": role, "content": content})
+                        chat_messages.append({"role": "user", "content": assembler.render(
+                            ["instructions", "earlier", "pinned", "memory", "goals", "question"])})
                         
-                        # Calculate and display latency
-                        latency = time.time() - start_time
-                        if preferences["ui_preferences"]["show_latency_monitor"]:
-                            st.caption(f"Response time: {latency:.2f}s")
-
-                # Save both messages to persistent memory (filtered)
-                save_message("user", prompt)
-                save_message("assistant", response)
+                        # Stream the response for better UX
+                        renderer = StreamRenderer(st.empty())
+                        gen_stats = {}
+                        for tok in stream_chat(chat_messages, model=PERSONA_MODEL or MODEL, stats=gen_stats):
+                            renderer.push(tok)
+                        response = renderer.close()
+                        turn_metrics["generation"] = gen_stats
+                        turn_metrics["render"] = renderer.stats()
+
+                    # Calculate and display latency
+                    latency = time.time() - start_time
+                    if preferences["ui_preferences"]["show_latency_monitor"]:
+                        render_stats = turn_metrics["render"]
+                        st.caption(f"Response time: {latency:.2f}s · {render_stats['flushes']} repaints "
+                                   f"for {render_stats['tokens']} tokens ({render_stats['flush_rate']:.0f}/s)")
+                        latency_panel(turn_metrics)
+
+                short_term.add("user", prompt)
+                short_term.add("assistant", response)
+
+                # Save both messages to persistent memory (filtered, one batch)
+                save_messages([
+                    {"role": "user", "content": prompt},
+                    {"role": "assistant", "content": response},
+                ])
                 
-                # Periodic memory compaction (every 20 messages)
-                memory_count = get_memory_stats()
-                if memory_count > 0 and memory_count % 20 == 0:
-                    summarize_and_compact()
+                # Compact once past compaction.max_messages, off the request path
+                # (the scheduler debounces; the run itself re-checks unpinned messages)
+                if get_memory_stats() > MEMORY_CONFIG["compaction"]["max_messages"]:
+                    request_compaction()
                 
                 # Save response to session
                 st.session_state.messages.append({"role": "assistant", "content": response})
@@ -305,29 +404,34 @@ with tab2:
     
     # Memory overview
     col1, col2, col3, col4 = st.columns(4)
+    memory_count = memory_overview["total"]
     with col1:
-        memory_count = get_memory_stats()
         st.metric("📊 Total Messages", memory_count)
     
     with col2:
-        if memory_count > 0:
-            messages = get_all_messages(limit=100)
-            user_count = len([m for m in messages if m['role'] == 'user'])
-            assistant_count = len([m for m in messages if m['role'] == 'assistant'])
-            st.metric("👤 User Messages", user_count)
-        else:
-            st.metric("👤 User Messages", 0)
+        st.metric("👤 User Messages", memory_overview["user"])
     
     with col3:
-        if memory_count > 0:
-            st.metric("🤖 Assistant Messages", assistant_count)
-        else:
-            st.metric("🤖 Assistant Messages", 0)
+        st.metric("🤖 Assistant Messages", memory_overview["assistant"])
     
     with col4:
-        pinned_count = len(get_pinned_messages())
-        st.metric("📌 Pinned Messages", pinned_count)
+        st.metric("📌 Pinned Messages", memory_overview["pinned"])
+    if memory_overview["summaries"]:
+        st.caption(f"🧾 {memory_overview['summaries']} compacted summaries")
     
+    # Background compaction status
+    compaction = get_compaction_status()
+    with st.expander(f"🧹 Compaction: {compaction['state']}", expanded=False):
+        if compaction.get("last_run"):
+            last_run = datetime.datetime.fromtimestamp(compaction['last_run']).strftime('%Y-%m-%d %H:%M:%S')
+            st.write(f"**Last run:** {last_run}")
+            st.write(f"**Duration:** {compaction.get('duration', 0):.2f}s")
+            st.write(f"**Docs compacted:** {compaction.get('docs_compacted', 0)}")
+            if not compaction.get("ok", True):
+                st.error(f"Last run failed: {compaction.get('error', '')}")
+        else:
+            st.write("No compaction has run yet.")
+
     # Memory inspection controls
     st.subheader("🔍 Memory Inspection")
     col1, col2 = st.columns([2, 1])
@@ -452,12 +556,13 @@ with tab3:
         st.subheader("🖥️ UI Preferences")
         show_tags = st.checkbox("Show Memory Tags", preferences["ui_preferences"]["show_memory_tags"])
         show_latency = st.checkbox("Show Latency Monitor", preferences["ui_preferences"]["show_latency_monitor"])
+        save_metrics = st.checkbox("Save Metrics to metrics.jsonl", preferences["ui_preferences"].get("save_metrics", False))
     
     with col2:
         st.subheader("🧠 Memory Settings")
         
         # Memory retention settings
-        short_term = st.number_input("Short-term Memory (messages)", 5, 50, preferences.get("memory_retention", {}).get("short_term", 10))
+        short_term_setting = st.number_input("Short-term Memory (messages)", 5, 50, preferences.get("memory_retention", {}).get("short_term", DEFAULT_WINDOW))
         summary_interval = st.number_input("Summary Interval", 10, 50, preferences.get("memory_retention", {}).get("long_term_summary_interval", 20))
         max_context = st.number_input("Max Context Messages", 1, 10, preferences.get("memory_retention", {}).get("max_context_messages", 3))
         
@@ -470,14 +575,15 @@ with tab3:
                     "directness": directness_weight
                 },
                 "memory_retention": {
-                    "short_term": short_term,
+                    "short_term": short_term_setting,
                     "long_term_summary_interval": summary_interval,
                     "max_context_messages": max_context
                 },
                 "ui_preferences": {
                     "personality_toggle": personality_toggle,
                     "show_memory_tags": show_tags,
-                    "show_latency_monitor": show_latency
+                    "show_latency_monitor": show_latency,
+                    "save_metrics": save_metrics
                 }
             }
             
@@ -0,0 +1,204 @@
+import json
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from memory import SRC_PATH, current_namespace, summarize_and_compact, use_namespace
+
+DEBOUNCE_SEC = 5.0           # coalesce bursts of requests into one run
+LOCK_STALE_SEC = 30 * 60     # a lock older than this is assumed abandoned
+LOCK_RETRY_SEC = 2.0         # first wait when another worker holds the lock
+LOCK_RETRY_MAX_SEC = 60.0    # backoff cap
+MANUAL_LIMIT = 40            # messages folded by a manual "Compact Memory" run
+LOCK_PATH = SRC_PATH / "compaction.lock"
+STATUS_PATH = SRC_PATH / "compaction_status.json"
+
+
+class FileLock:
+    """Cross-process, cross-platform exclusive lock based on O_EXCL file creation."""
+
+    def __init__(self, path: Path, stale_after: float = LOCK_STALE_SEC):
+        self.path = Path(path)
+        self.stale_after = stale_after
+        self._held = False
+
+    def _owner(self) -> Optional[str]:
+        """The "<pid> <time>" written by the holder, or None if there is no lock."""
+        try:
+            with open(self.path, "r") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _is_stale(self, owner: str) -> bool:
+        try:
+            taken = float(owner.split()[1])
+        except (IndexError, ValueError):
+            # Holder is still writing (or crashed before writing): go by mtime
+            try:
+                taken = self.path.stat().st_mtime
+            except FileNotFoundError:
+                return True
+        return time.time() - taken > self.stale_after
+
+    def acquire(self) -> bool:
+        """Try once to take the lock; returns False if another worker holds it."""
+        for _ in range(2):
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                owner = self._owner()
+                if owner is None:
+                    continue
+                if not self._is_stale(owner):
+                    return False
+                # Only break the lock we judged stale: if another worker already
+                # replaced it, its fresh lock must survive
+                if self._owner() != owner:
+                    return False
+                try:
+                    self.path.unlink()
+                except FileNotFoundError:
+                    pass
+                continue
+            with os.fdopen(fd, "w") as f:
+                f.write(f"{os.getpid()} {time.time()}")
+            self._held = True
+            return True
+        return False
+
+    def release(self):
+        if self._held:
+            self._held = False
+            try:
+                self.path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class CompactionScheduler:
+    """Runs compaction on a daemon thread so chat turns never wait for it.
+
+    Requests are queued per memory namespace (with an optional `limit` that
+    compacts regardless of the size threshold) and debounced; at most one run
+    happens at a time across all worker processes (guarded by a FileLock). The
+    last result is written to a status file so every worker can display it.
+    """
+
+    def __init__(self, compact_fn: Callable[..., int], lock_path: Path = LOCK_PATH,
+                 status_path: Path = STATUS_PATH, debounce_sec: float = DEBOUNCE_SEC):
+        self.compact_fn = compact_fn
+        self.lock = FileLock(lock_path)
+        self.status_path = Path(status_path)
+        self.debounce_sec = debounce_sec
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._state = "idle"
+        self._thread = threading.Thread(target=self._worker, name="memory-compaction", daemon=True)
+        self._thread.start()
+
+    def request(self, force: bool = False, namespace: str = "", limit: Optional[int] = None):
+        """Ask for a compaction run of `namespace`; `force` skips the debounce wait
+        and `limit` is passed to compact_fn (None = only past the threshold)."""
+        if self._state == "idle":
+            self._state = "pending"
+        self._queue.put((force, namespace, limit))
+
+    @staticmethod
+    def _merge(pending: Dict[str, Optional[int]], namespace: str, limit: Optional[int]):
+        """Coalesce requests per namespace; the largest explicit limit wins."""
+        current = pending.get(namespace)
+        pending[namespace] = limit if current is None else max(current, limit or 0)
+
+    def status(self) -> Dict:
+        try:
+            with open(self.status_path, "r") as f:
+                status = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            status = {}
+        status["state"] = self._state
+        return status
+
+    def _worker(self):
+        while True:
+            force, namespace, limit = self._queue.get()
+            pending: Dict[str, Optional[int]] = {}
+            self._merge(pending, namespace, limit)
+            # Debounce: keep absorbing requests until the queue is quiet
+            while not force:
+                try:
+                    force, namespace, limit = self._queue.get(timeout=self.debounce_sec)
+                except queue.Empty:
+                    break
+                self._merge(pending, namespace, limit)
+            self._drain(pending)
+            # Another worker holds the lock: keep the requests and retry with backoff
+            delay = LOCK_RETRY_SEC
+            while not self._run_once(pending):
+                time.sleep(delay)
+                delay = min(delay * 2, LOCK_RETRY_MAX_SEC)
+                self._drain(pending)
+
+    def _drain(self, pending: Dict[str, Optional[int]]):
+        while not self._queue.empty():
+            _, namespace, limit = self._queue.get_nowait()
+            self._merge(pending, namespace, limit)
+
+    def _run_once(self, pending: Dict[str, Optional[int]]) -> bool:
+        """Compact every pending namespace; False if the lock was busy."""
+        if not self.lock.acquire():
+            self._state = "pending"
+            return False
+        self._state = "running"
+        started = time.time()
+        result = {"last_run": started, "namespaces": sorted(pending), "docs_compacted": 0}
+        try:
+            for namespace in sorted(pending):
+                with use_namespace(namespace):
+                    result["docs_compacted"] += int(self.compact_fn(limit=pending[namespace]) or 0)
+            result["ok"] = True
+        except Exception as e:
+            print("compaction err:", e)
+            result.update(ok=False, error=str(e))
+        finally:
+            result["duration"] = time.time() - started
+            self.lock.release()
+            self._state = "pending" if not self._queue.empty() else "idle"
+        self._write_status(result)
+        return True
+
+    def _write_status(self, result: Dict):
+        try:
+            tmp = self.status_path.with_suffix(".tmp")
+            with open(tmp, "w") as f:
+                json.dump(result, f)
+            os.replace(tmp, self.status_path)
+        except Exception as e:
+            print("compaction status err:", e)
+
+
+_SCHEDULER: Optional[CompactionScheduler] = None
+_SCHEDULER_LOCK = threading.Lock()
+
+
+def get_scheduler() -> CompactionScheduler:
+    global _SCHEDULER
+    if _SCHEDULER is None:
+        with _SCHEDULER_LOCK:
+            if _SCHEDULER is None:
+                _SCHEDULER = CompactionScheduler(summarize_and_compact)
+    return _SCHEDULER
+
+
+def request_compaction(force: bool = False, namespace: Optional[str] = None, limit: Optional[int] = None):
+    """Queue a background compaction run of `namespace` (default: the caller's
+    current namespace); returns immediately. `limit` compacts up to that many of
+    the oldest messages even below compaction.max_messages."""
+    get_scheduler().request(force, current_namespace() if namespace is None else namespace, limit)
+
+
+def get_compaction_status() -> Dict:
+    """Last run time, duration, docs compacted and current state."""
+    return get_scheduler().status()
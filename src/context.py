@@ -0,0 +1,124 @@
+import math
+from typing import Callable, Dict, List, Optional
+
+from llm_utils import DEFAULT_OPTIONS
+
+# Room kept free for the reply and chat-template overhead
+RESPONSE_RESERVE = DEFAULT_OPTIONS["num_predict"]
+TEMPLATE_OVERHEAD = 64
+# Pinned facts offered to the prompt (persona_config: pinned_memory_count)
+PINNED_IN_PROMPT = 10
+# A lone line is shortened down to this before the section is dropped
+MIN_LINE_CHARS = 80
+
+
+def approx_tokens(text: str) -> int:
+    """Cheap estimate for Llama-family BPE: ~4 characters per token."""
+    return math.ceil(len(text) / 4) if text else 0
+
+
+_TOKENIZER: Callable[[str], int] = approx_tokens
+
+
+def set_tokenizer(count_fn: Callable[[str], int]):
+    """Swap the token counter process-wide, e.g. with a real tokenizer:
+    tok = tokenizers.Tokenizer.from_pretrained(...); set_tokenizer(lambda t: len(tok.encode(t).ids))"""
+    global _TOKENIZER
+    _TOKENIZER = count_fn
+
+
+def count_tokens(text: str) -> int:
+    return _TOKENIZER(text)
+
+
+class Section:
+    """One block of the prompt: an optional title plus lines (items)."""
+
+    def __init__(self, name: str, lines: List[str], priority: int, title: str = "",
+                 max_tokens: Optional[int] = None, required: bool = False, drop_from: str = "end"):
+        self.name = name
+        self.lines = [l for l in lines if l]
+        self.priority = priority          # lower = more important, trimmed last
+        self.title = title
+        self.max_tokens = max_tokens
+        self.required = required          # never trimmed or dropped
+        self.drop_from = drop_from        # "end": least relevant last; "start": oldest first
+
+    def text(self) -> str:
+        if not self.lines:
+            return ""
+        body = "\n".join(self.lines)
+        return f"{self.title}\n{body}" if self.title else body
+
+    def tokens(self) -> int:
+        return count_tokens(self.text())
+
+    def drop_one(self) -> bool:
+        """Drop the least valuable line; a lone long line is shortened first.
+        Every call that returns True makes the section strictly smaller."""
+        if self.required or not self.lines:
+            return False
+        if len(self.lines) == 1:
+            line = self.lines[0]
+            shorter = line[:max(MIN_LINE_CHARS, len(line) * 3 // 4)].rstrip() + "…"
+            if len(shorter) < len(line):
+                self.lines[0] = shorter
+                return True
+        self.lines.pop(-1 if self.drop_from == "end" else 0)
+        return True
+
+
+class ContextAssembler:
+    """Fits prompt sections into a token budget.
+
+    Each section is first cut to its own max_tokens; if the total is still over
+    budget, lines are dropped from the least important section first (highest
+    priority number) until everything fits. Required sections are kept whole;
+    if they alone exceed the budget the result reports the `overflow`.
+    """
+
+    def __init__(self, budget: Optional[int] = None):
+        if budget is None:
+            budget = DEFAULT_OPTIONS["num_ctx"] - RESPONSE_RESERVE - TEMPLATE_OVERHEAD
+        self.budget = budget
+        self.sections: Dict[str, Section] = {}
+
+    def add(self, name: str, lines: List[str], priority: int, **kwargs) -> "ContextAssembler":
+        self.sections[name] = Section(name, list(lines), priority, **kwargs)
+        return self
+
+    def build(self) -> Dict:
+        dropped: Dict[str, int] = {}
+
+        def drop(section: Section) -> bool:
+            if section.drop_one():
+                dropped[section.name] = dropped.get(section.name, 0) + 1
+                return True
+            return False
+
+        for section in self.sections.values():
+            while section.max_tokens is not None and section.tokens() > section.max_tokens and drop(section):
+                pass
+
+        trimmable = [s for s in self.sections.values() if not s.required]
+        for section in sorted(trimmable, key=lambda s: s.priority, reverse=True):
+            while self.total_tokens() > self.budget and drop(section):
+                pass
+
+        per_section = {name: s.tokens() for name, s in self.sections.items()}
+        tokens = sum(per_section.values())
+        return {
+            "tokens": tokens,
+            "budget": self.budget,
+            "overflow": max(0, tokens - self.budget),
+            "per_section": per_section,
+            "dropped": dropped,
+        }
+
+    def total_tokens(self) -> int:
+        return sum(s.tokens() for s in self.sections.values())
+
+    def render(self, names: List[str]) -> str:
+        """Join the named sections (in that order), skipping empty ones."""
+        parts = [self.sections[n].text() for n in names if n in self.sections]
+        return "\n\n".join(p for p in parts if p)
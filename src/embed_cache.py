@@ -0,0 +1,185 @@
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from quantize import dequantize, quantize
+
+
+class DiskVectorTier:
+    """Restart-safe vector cache shared by worker processes.
+
+    Vectors live in a fixed-size memory-mapped float32 file used as a ring of
+    slots; a small SQLite index maps cache keys to (slot, generation). A writer
+    first commits the slot's release, then rewrites the vector, then commits the
+    new key; readers re-check their key's (slot, generation) after copying the
+    vector, so a slot recycled by another worker mid-read is reported as a miss.
+    """
+
+    def __init__(self, path: Path, capacity: int = 100_000):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.capacity = int(capacity)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path / "index.sqlite"), timeout=10, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS slots (key TEXT PRIMARY KEY, slot INTEGER UNIQUE, gen INTEGER)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+        if "gen" not in {r[1] for r in self._db.execute("PRAGMA table_info(slots)")}:
+            self._db.execute("ALTER TABLE slots ADD COLUMN gen INTEGER")
+        self._vectors: Optional[np.memmap] = None
+        self.dim: Optional[int] = None
+        self._reopen()
+
+    def _reopen(self):
+        """Map the vector file once any worker has recorded the dimension."""
+        row = self._db.execute("SELECT value FROM meta WHERE name='dim'").fetchone()
+        if row:
+            self._open(int(row[0]))
+
+    def _open(self, dim: int):
+        cap_row = self._db.execute("SELECT value FROM meta WHERE name='capacity'").fetchone()
+        if cap_row:
+            self.capacity = int(cap_row[0])
+        vec_path = self.path / "vectors.f32"
+        mode = "r+" if vec_path.exists() else "w+"
+        self._vectors = np.memmap(vec_path, dtype=np.float32, mode=mode, shape=(self.capacity, dim))
+        self.dim = dim
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            if self._vectors is None:
+                self._reopen()
+                if self._vectors is None:
+                    return None
+            row = self._db.execute("SELECT slot, gen FROM slots WHERE key=?", (key,)).fetchone()
+        if not row:
+            return None
+        vec = np.array(self._vectors[row[0]], dtype=np.float32)
+        with self._lock:
+            again = self._db.execute("SELECT slot, gen FROM slots WHERE key=?", (key,)).fetchone()
+        return vec if again == row else None
+
+    def put(self, key: str, vec: np.ndarray):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                if self._vectors is None:
+                    row = self._db.execute("SELECT value FROM meta WHERE name='dim'").fetchone()
+                    if not row:
+                        self._db.execute("INSERT INTO meta VALUES ('dim', ?), ('capacity', ?), ('next', 0)",
+                                         (int(vec.shape[0]), self.capacity))
+                    self._open(int(row[0]) if row else int(vec.shape[0]))
+                if self._db.execute("SELECT 1 FROM slots WHERE key=?", (key,)).fetchone():
+                    self._db.execute("COMMIT")
+                    return
+                nxt = self._db.execute("SELECT value FROM meta WHERE name='next'").fetchone()[0]
+                slot = nxt % self.capacity
+                self._db.execute("DELETE FROM slots WHERE slot=?", (slot,))
+                self._db.execute("UPDATE meta SET value=? WHERE name='next'", (nxt + 1,))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            # The slot is unreferenced now; readers of its old key see a miss
+            self._vectors[slot] = vec
+            self._vectors.flush()
+            self._db.execute("INSERT OR REPLACE INTO slots VALUES (?, ?, ?)", (key, slot, nxt))
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM slots").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM slots")
+            self._db.execute("UPDATE meta SET value=0 WHERE name='next'")
+
+
+class EmbeddingCache:
+    """Size-bounded LRU of vectors with an optional on-disk tier.
+
+    Entries are held as `dtype` (float32, float16 or int8 with a per-vector
+    scale) and handed out as float32; the disk tier always keeps float32.
+    put() returns the caller's full-precision vector, and get(exact=True) skips
+    quantized entries, so vectors that get persisted are never the lossy copy.
+    """
+
+    def __init__(self, max_entries: int = 4096, disk: Optional[DiskVectorTier] = None, dtype: str = "float32"):
+        self.max_entries = int(max_entries)
+        self.disk = disk
+        self.dtype = dtype
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+    def get(self, key: str, exact: bool = False) -> Optional[np.ndarray]:
+        lossy = self.dtype != "float32"
+        with self._lock:
+            entry = None if exact and lossy else self._data.get(key)
+            if entry is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+        if entry is not None:
+            return dequantize(*entry) if lossy else entry[0]
+        if self.disk is not None:
+            vec = self.disk.get(key)
+            if vec is not None:
+                self.disk_hits += 1
+                self._remember(key, vec)
+                return vec
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, vec) -> np.ndarray:
+        """Store `vec`; returns it unchanged as float32 (not the quantized copy)."""
+        vec = np.asarray(vec, dtype=np.float32)
+        self._remember(key, vec)
+        if self.disk is not None:
+            try:
+                self.disk.put(key, vec)
+            except Exception as e:
+                print("embed cache disk err:", e)
+        return vec
+
+    def _remember(self, key: str, vec: np.ndarray):
+        codes, scales = quantize(vec, self.dtype)
+        entry = (codes[0], scales[0])
+        with self._lock:
+            self._data[key] = entry
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        with self._lock:
+            nbytes = sum(codes.nbytes + (4 if self.dtype == "int8" else 0) for codes, _ in self._data.values())
+        return {
+            "size": len(self._data),
+            "dtype": self.dtype,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "bytes": nbytes,
+        }
@@ -0,0 +1,114 @@
+import os
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Union
+
+import numpy as np
+
+# Embedding providers: all produce the same L2-normalized sentence vectors for a
+# given model, so switching provider needs no reindex. Register more with
+# register_provider(name, factory).
+
+_PROVIDERS: Dict[str, Callable[..., "EmbeddingProvider"]] = {}
+
+
+def register_provider(name: str, factory: Callable[..., "EmbeddingProvider"]):
+    _PROVIDERS[name] = factory
+
+
+def hf_repo(model_name: str) -> str:
+    """Short sentence-transformers names live under the sentence-transformers org."""
+    return model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+
+
+class EmbeddingProvider(ABC):
+    """Interface: encode(str) -> (dim,) and encode(list) -> (n, dim) float32."""
+
+    name = "base"
+
+    def encode(self, texts: Union[str, List[str]], batch_size: int = 64) -> np.ndarray:
+        single = isinstance(texts, str)
+        vecs = self._encode([texts] if single else list(texts), batch_size)
+        return vecs[0] if single else vecs
+
+    @abstractmethod
+    def _encode(self, texts: List[str], batch_size: int) -> np.ndarray:
+        """Encode a list of texts to an (n, dim) float32 array."""
+
+
+class SentenceTransformerProvider(EmbeddingProvider):
+    """PyTorch sentence-transformers model (the original backend)."""
+
+    name = "sentence-transformers"
+
+    def __init__(self, model_name: str, threads: int = 0, **_):
+        if threads:
+            import torch
+            torch.set_num_threads(int(threads))
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+
+    def _encode(self, texts: List[str], batch_size: int) -> np.ndarray:
+        return np.asarray(self.model.encode(texts, batch_size=batch_size), dtype=np.float32)
+
+
+class OnnxProvider(EmbeddingProvider):
+    """Same model on ONNX Runtime (CPU): the `onnx/` export published with the
+    sentence-transformers checkpoint, its fast tokenizer, then mean pooling and
+    L2 normalization as in the model's sentence-transformers pipeline."""
+
+    name = "onnx"
+    # int8 dynamic-quantized export shipped alongside onnx/model.onnx
+    QUANTIZED_FILE = "onnx/model_quint8_avx2.onnx"
+
+    def __init__(self, model_name: str, threads: int = 0, quantized: bool = False,
+                 onnx_file: Optional[str] = None, max_length: int = 256, **_):
+        import onnxruntime as ort
+        from huggingface_hub import hf_hub_download
+        from tokenizers import Tokenizer
+
+        repo = hf_repo(model_name)
+        onnx_file = onnx_file or (self.QUANTIZED_FILE if quantized else "onnx/model.onnx")
+        self.tokenizer = Tokenizer.from_file(hf_hub_download(repo, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = int(threads) or (os.cpu_count() or 1)
+        opts.inter_op_num_threads = 1
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(hf_hub_download(repo, onnx_file), opts,
+                                            providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _encode(self, texts: List[str], batch_size: int) -> np.ndarray:
+        out = []
+        for start in range(0, len(texts), batch_size):
+            batch = self.tokenizer.encode_batch(texts[start:start + batch_size])
+            ids = np.array([e.ids for e in batch], dtype=np.int64)
+            mask = np.array([e.attention_mask for e in batch], dtype=np.int64)
+            feeds = {"input_ids": ids, "attention_mask": mask}
+            if "token_type_ids" in self.input_names:
+                feeds["token_type_ids"] = np.zeros_like(ids)
+            hidden = self.session.run(None, feeds)[0]
+            out.append(mean_pool_normalize(hidden, mask))
+        return np.concatenate(out) if out else np.zeros((0, 0), dtype=np.float32)
+
+
+def mean_pool_normalize(hidden: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """Average token states over the attention mask, then scale to unit length."""
+    m = mask[..., None].astype(np.float32)
+    pooled = (hidden * m).sum(axis=1) / np.clip(m.sum(axis=1), 1e-9, None)
+    norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+    return (pooled / np.clip(norms, 1e-12, None)).astype(np.float32)
+
+
+register_provider(SentenceTransformerProvider.name, SentenceTransformerProvider)
+register_provider(OnnxProvider.name, OnnxProvider)
+
+
+def load_provider(model_name: str, cfg: Optional[Dict] = None) -> EmbeddingProvider:
+    """Build the provider named by cfg["provider"] (default sentence-transformers)."""
+    cfg = dict(cfg or {})
+    name = cfg.pop("provider", SentenceTransformerProvider.name)
+    if name not in _PROVIDERS:
+        raise ValueError(f"Unknown embedding provider: {name} (have {', '.join(sorted(_PROVIDERS))})")
+    return _PROVIDERS[name](model_name, **cfg)
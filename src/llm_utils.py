@@ -1,68 +1,312 @@
-import requests
+import asyncio
 import json
+import queue
+import threading
+import time
+import weakref
+
+import httpx
+
+import metrics
 
 # Ollama HTTP API Configuration
 OLLAMA_URL = "http://localhost:11434/api/generate"
+OLLAMA_CHAT_URL = "http://localhost:11434/api/chat"
 MODEL = "llama3.1"           # or "llama3.1:Q4_K_M" if you have it locally for speed
 KEEP_ALIVE = "1h"            # keep model hot in RAM
 
+# Set to "friday" after `ollama create friday -f src/config/Modelfile` (setup.ps1
+# -RegisterPersona): the Modelfile SYSTEM block then is the system prompt and the
+# app stops sending its own.
+PERSONA_MODEL = None
+
+# HTTP client tuning
+CONNECT_TIMEOUT = 3.05       # seconds to establish the TCP connection
+READ_TIMEOUT = 300           # seconds between bytes; long generations stream within this
+MAX_RETRIES = 3              # connection errors only; a started generation is never replayed
+RETRY_BACKOFF = 0.5          # 0.5s, 1s, 2s ...
+POOL_SIZE = 8
+MAX_CONCURRENCY_PER_MODEL = 2   # in-flight generations per model (match OLLAMA_NUM_PARALLEL)
+
+# Decoding defaults shared by every request
+DEFAULT_OPTIONS = {
+    "temperature": 0.3,
+    "top_p": 0.92,
+    "top_k": 40,
+    "repeat_penalty": 1.05,
+    "num_ctx": 3072,
+    "num_predict": 512,
+    "stop": ["\nUser:", "\nAssistant:"]
+}
+
+# One AsyncClient / limiter set per event loop (httpx connections are loop-bound)
+_ASYNC_CLIENTS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+_MODEL_LIMITS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = weakref.WeakKeyDictionary()
+
+# Background event loop that backs the sync wrappers
+_LOOP = None
+_LOOP_LOCK = threading.Lock()
+_DONE = object()
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Pooled keep-alive client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _ASYNC_CLIENTS.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE),
+        )
+        _ASYNC_CLIENTS[loop] = client
+    return client
+
+
+def _model_limiter(model: str) -> asyncio.Semaphore:
+    limits = _MODEL_LIMITS.setdefault(asyncio.get_running_loop(), {})
+    if model not in limits:
+        limits[model] = asyncio.Semaphore(MAX_CONCURRENCY_PER_MODEL)
+    return limits[model]
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    global _LOOP
+    if _LOOP is None:
+        with _LOOP_LOCK:
+            if _LOOP is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="ollama-io", daemon=True).start()
+                _LOOP = loop
+    return _LOOP
+
 
-def stream_ollama(prompt: str, model: str = MODEL, opts: dict | None = None):
-    """Yields tokens as they arrive. Use in Streamlit to display streaming text."""
+def build_options(opts: dict | None = None) -> dict:
+    """Decoding options: defaults overlaid with per-call overrides."""
+    return DEFAULT_OPTIONS | (opts or {})
+
+
+def build_payload(prompt: str, model: str = MODEL, stream: bool = True, opts: dict | None = None,
+                  fmt: dict | str | None = None) -> dict:
     payload = {
         "model": model,
         "prompt": prompt,
-        "stream": True,
+        "stream": stream,
         "keep_alive": KEEP_ALIVE,
-        "options": {
-            "temperature": 0.3,
-            "top_p": 0.92,
-            "top_k": 40,
-            "repeat_penalty": 1.05,
-            "num_ctx": 3072,
-            "num_predict": 512,
-            "stop": ["\nUser:", "\nAssistant:"]
-        } | (opts or {})
+        "options": build_options(opts),
     }
+    if fmt is not None:
+        payload["format"] = fmt   # "json" or a JSON schema (structured outputs)
+    return payload
+
+
+def build_chat_payload(messages: list[dict], model: str = MODEL, stream: bool = True,
+                       opts: dict | None = None, fmt: dict | str | None = None) -> dict:
+    """/api/chat payload. Keep messages[0] (the system prompt) byte-identical
+    across turns and only append after it, so Ollama can reuse its KV cache for
+    the shared prefix instead of re-evaluating the whole prompt."""
+    payload = {
+        "model": model,
+        "messages": messages,
+        "stream": stream,
+        "keep_alive": KEEP_ALIVE,
+        "options": build_options(opts),
+    }
+    if fmt is not None:
+        payload["format"] = fmt
+    return payload
+
+
+def validate_json(value, schema: dict) -> bool:
+    """Minimal JSON-schema check (type, required, properties, items, min/maxItems)."""
+    types = {"object": dict, "array": list, "string": str, "number": (int, float), "integer": int, "boolean": bool}
+    expected = schema.get("type")
+    if expected and not isinstance(value, types[expected]):
+        return False
+    if isinstance(value, dict):
+        if any(k not in value for k in schema.get("required", [])):
+            return False
+        props = schema.get("properties", {})
+        return all(validate_json(value[k], sub) for k, sub in props.items() if k in value)
+    if isinstance(value, list):
+        if len(value) < schema.get("minItems", 0) or len(value) > schema.get("maxItems", len(value)):
+            return False
+        return all(validate_json(v, schema.get("items", {})) for v in value)
+    return True
+
+
+class GenerationTimer:
+    """Client-side timing of one streamed generation, merged with the counters
+    Ollama reports in its final "done" chunk."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first = None
+        self.last = None
+        self.tokens = 0
+        self.gaps: list[float] = []
 
+    def token(self):
+        now = time.perf_counter()
+        if self.first is None:
+            self.first = now
+        else:
+            self.gaps.append(now - self.last)
+        self.last = now
+        self.tokens += 1
+
+    def result(self, final: dict | None = None) -> dict:
+        out = {"tokens": self.tokens, "wall_ms": (time.perf_counter() - self.start) * 1000.0}
+        if self.first is not None:
+            out["ttft_ms"] = (self.first - self.start) * 1000.0
+        if self.gaps:
+            gaps = sorted(self.gaps)
+            out["itl_mean_ms"] = sum(gaps) / len(gaps) * 1000.0
+            out["itl_p95_ms"] = gaps[int(0.95 * (len(gaps) - 1))] * 1000.0
+            out["tokens_per_sec"] = len(gaps) / max(self.last - self.first, 1e-9)
+        final = final or {}
+        for key in ("eval_count", "prompt_eval_count"):
+            if key in final:
+                out[key] = final[key]
+        for key in ("eval_duration", "prompt_eval_duration", "load_duration", "total_duration"):
+            if key in final:
+                out[key.replace("_duration", "_ms")] = final[key] / 1e6   # ns -> ms
+        if final.get("eval_count") and final.get("eval_duration"):
+            out["eval_tokens_per_sec"] = final["eval_count"] / (final["eval_duration"] / 1e9)
+        return out
+
+
+async def _astream(url: str, payload: dict, token_of, stats: dict | None = None):
+    """Shared streaming loop for /api/generate and /api/chat (see astream_ollama)."""
+    model = payload["model"]
+    timer = GenerationTimer()
+    final = None
     try:
-        with requests.post(OLLAMA_URL, json=payload, stream=True, timeout=30) as r:
-            r.raise_for_status()
-            for line in r.iter_lines():
-                if not line:
-                    continue
-                data = json.loads(line.decode("utf-8"))
-                if "response" in data:
-                    yield data["response"]
-                if data.get("done"):
-                    break
+        async with _model_limiter(model):
+            for attempt in range(MAX_RETRIES + 1):
+                try:
+                    async with get_async_client().stream("POST", url, json=payload) as r:
+                        r.raise_for_status()
+                        # Read to the end of the body (not break on "done") so the
+                        # connection goes back to the pool instead of being discarded.
+                        async for line in r.aiter_lines():
+                            if not line or final is not None:
+                                continue
+                            data = json.loads(line)
+                            token = token_of(data)
+                            if token:
+                                timer.token()
+                                yield token
+                            if data.get("done"):
+                                final = data
+                    return
+                except (httpx.ConnectError, httpx.ConnectTimeout):
+                    if attempt == MAX_RETRIES:
+                        raise
+                    await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
     except Exception as e:
         yield f"⚠️ Error: {str(e)}"
+    finally:
+        result = timer.result(final)
+        result["completed"] = final is not None
+        if stats is not None:
+            stats.update(result)
+        metrics.emit("generation", model=model, endpoint=url.rsplit("/", 1)[-1], **result)
 
 
-def query_ollama(prompt: str, model: str = MODEL):
-    """Legacy function for non-streaming responses."""
+async def astream_ollama(prompt: str, model: str = MODEL, opts: dict | None = None, stats: dict | None = None):
+    """Async generator of tokens. Cancelling the consuming task closes the HTTP stream.
+
+    If `stats` is given it is filled with TTFT, inter-token latency, tokens/sec and
+    Ollama's eval/prompt_eval counters once the stream ends; the same record is
+    emitted as a "generation" metrics event.
+    """
+    payload = build_payload(prompt, model, stream=True, opts=opts)
+    async for token in _astream(OLLAMA_URL, payload, lambda d: d.get("response"), stats):
+        yield token
+
+
+async def astream_chat(messages: list[dict], model: str = MODEL, opts: dict | None = None, stats: dict | None = None):
+    """Like astream_ollama but over /api/chat with a structured message list."""
+    payload = build_chat_payload(messages, model, stream=True, opts=opts)
+    async for token in _astream(OLLAMA_CHAT_URL, payload, lambda d: (d.get("message") or {}).get("content"), stats):
+        yield token
+
+
+async def aquery_ollama(prompt: str, model: str = MODEL, opts: dict | None = None,
+                        fmt: dict | str | None = None) -> str:
+    """Async non-streaming generation."""
     try:
-        payload = {
-            "model": model,
-            "prompt": prompt,
-            "stream": False,
-            "keep_alive": KEEP_ALIVE,
-            "options": {
-                "temperature": 0.3,
-                "top_p": 0.92,
-                "top_k": 40,
-                "repeat_penalty": 1.05,
-                "num_ctx": 3072,
-                "num_predict": 512,
-                "stop": ["\nUser:", "\nAssistant:"]
-            }
-        }
-
-        response = requests.post(OLLAMA_URL, json=payload, timeout=30)
+        payload = build_payload(prompt, model, stream=False, opts=opts, fmt=fmt)
+        async with _model_limiter(model):
+            for attempt in range(MAX_RETRIES + 1):
+                try:
+                    response = await get_async_client().post(OLLAMA_URL, json=payload)
+                    break
+                except (httpx.ConnectError, httpx.ConnectTimeout):
+                    if attempt == MAX_RETRIES:
+                        raise
+                    await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
         response.raise_for_status()
         return response.json().get("response", "").strip()
     except Exception as e:
         return f"⚠️ Exception: {e}"
 
 
+async def aquery_ollama_json(prompt: str, schema: dict, model: str = MODEL, opts: dict | None = None) -> dict | None:
+    """One structured-output request; returns the parsed object or None if it
+    is not valid JSON matching `schema`."""
+    raw = await aquery_ollama(prompt, model, opts, fmt=schema)
+    try:
+        value = json.loads(raw)
+    except json.JSONDecodeError:
+        print("query_ollama_json err:", raw[:200])
+        return None
+    if not validate_json(value, schema):
+        print("query_ollama_json err: response does not match schema")
+        return None
+    return value
+
+
+def _iter_async(agen):
+    """Drive an async generator on the background loop and yield its items here.
+    Closing this generator (e.g. Streamlit stopping the script) cancels the task."""
+    q: "queue.Queue" = queue.Queue()
+
+    async def pump():
+        try:
+            async for item in agen:
+                q.put(item)
+        finally:
+            q.put(_DONE)
+
+    future = asyncio.run_coroutine_threadsafe(pump(), _background_loop())
+    try:
+        while True:
+            item = q.get()
+            if item is _DONE:
+                break
+            yield item
+    finally:
+        if not future.done():
+            future.cancel()
+
+
+def stream_ollama(prompt: str, model: str = MODEL, opts: dict | None = None, stats: dict | None = None):
+    """Yields tokens as they arrive. Use in Streamlit to display streaming text.
+    Pass a dict as `stats` to receive timing (see astream_ollama)."""
+    yield from _iter_async(astream_ollama(prompt, model, opts, stats))
+
+
+def stream_chat(messages: list[dict], model: str = MODEL, opts: dict | None = None, stats: dict | None = None):
+    """Sync wrapper around astream_chat."""
+    yield from _iter_async(astream_chat(messages, model, opts, stats))
+
+
+def query_ollama(prompt: str, model: str = MODEL, opts: dict | None = None, fmt: dict | str | None = None):
+    """Legacy function for non-streaming responses."""
+    return asyncio.run_coroutine_threadsafe(aquery_ollama(prompt, model, opts, fmt), _background_loop()).result()
+
+
+def query_ollama_json(prompt: str, schema: dict, model: str = MODEL, opts: dict | None = None) -> dict | None:
+    """Sync wrapper around aquery_ollama_json."""
+    return asyncio.run_coroutine_threadsafe(aquery_ollama_json(prompt, schema, model, opts), _background_loop()).result()
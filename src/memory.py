@@ -1,34 +1,274 @@
-import chromadb
-from sentence_transformers import SentenceTransformer
 import re
 import hashlib
+import json
+import threading
 import time
-from typing import List
+import numpy as np
+import yaml
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional, Tuple
 from pathlib import Path
 
+from embed_cache import DiskVectorTier, EmbeddingCache
+from metrics import timed
+from ranking import rank
+
 # Paths
 ROOT_PATH = Path(__file__).resolve().parent.parent
 SRC_PATH = Path(__file__).resolve().parent
 
-# Initialize embedding model
-embed_model = SentenceTransformer('all-MiniLM-L6-v2')  # lightweight and free
+# Defaults for src/config/memory_config.yaml
+DEFAULT_MEMORY_CONFIG = {
+    "embedding_model": "all-MiniLM-L6-v2",
+    "embedding": {
+        "provider": "sentence-transformers",
+        "threads": 0,
+        "quantized": False,
+    },
+    "backend": "chroma",
+    "chroma_path": "chroma_db",
+    "numpy_path": "numpy_store",
+    "numpy_index": {
+        "quantization": "none",
+        "binary_prefilter": False,
+        "rerank_factor": 4,
+    },
+    "isolation": "user",
+    "session_ttl_hours": 24,
+    "ranking": {
+        "strategy": "hybrid",
+        "candidates": 12,
+        "recency_half_life_hours": 72,
+        "mmr_lambda": 0.7,
+        "weights": {},
+    },
+    "dedupe": {
+        "enabled": True,
+        "near_threshold": 0.95,
+    },
+    "compaction": {
+        "max_messages": 200,
+        "keep_recent": 50,
+        "chunk_size": 20,
+        "max_chunks": 5,
+        "max_summaries": 50,
+    },
+    "embedding_cache": {
+        "max_entries": 4096,
+        "disk_path": None,
+        "disk_capacity": 100000,
+        "dtype": "float32",
+    },
+}
+
+
+def _merge(base: Dict, override: Dict) -> Dict:
+    out = dict(base)
+    for k, v in (override or {}).items():
+        out[k] = _merge(out[k], v) if isinstance(out.get(k), dict) and isinstance(v, dict) else v
+    return out
+
+
+def load_memory_config() -> Dict:
+    """Load memory settings from src/config/memory_config.yaml merged over defaults."""
+    try:
+        with open(SRC_PATH / 'config' / 'memory_config.yaml', 'r') as file:
+            return _merge(DEFAULT_MEMORY_CONFIG, yaml.safe_load(file) or {})
+    except FileNotFoundError:
+        return _merge(DEFAULT_MEMORY_CONFIG, {})
+
+
+MEMORY_CONFIG = load_memory_config()
 
-# Initialize ChromaDB client (persist inside src folder)
-client = chromadb.PersistentClient(path=str(SRC_PATH / "chroma_db"))
+# Embedding model and ChromaDB client are created on first use (see get_embed_model /
+# get_collection) so importing this module stays cheap; warmup_memory() preloads them.
+_embed_model = None
+_client = None
+_COLLECTIONS: "OrderedDict[str, object]" = OrderedDict()
+_INIT_LOCK = threading.RLock()
+# Per-namespace handles and caches keep the most recently used namespaces only
+_MAX_NAMESPACES = 256
 
-# Create or get collection
 collection_name = "friday_memory"
-try:
-    collection = client.get_collection(collection_name)
-except:
-    collection = client.create_collection(collection_name)
+# Namespace prefix used by isolation: session (see prune_session_memory)
+SESSION_PREFIX = "session-"
+
+
+def _remember_namespace(cache: "OrderedDict", namespace: str, value):
+    """Insert into a per-namespace cache, forgetting the least recently used."""
+    cache[namespace] = value
+    cache.move_to_end(namespace)
+    while len(cache) > _MAX_NAMESPACES:
+        cache.popitem(last=False)
+
+# Memory namespace (one collection each) and chat session (working goals) for the
+# current thread/task. Streamlit runs every session's script on its own thread, so
+# app.py sets both at the top of each rerun; "" is the shared default.
+_NAMESPACE: ContextVar[str] = ContextVar("friday_namespace", default="")
+_SESSION: ContextVar[str] = ContextVar("friday_session", default="")
+
 
-# Embedding cache for performance
-_EMBED_CACHE = {}
+def set_namespace(namespace: str = "", session: Optional[str] = None):
+    """Route memory calls on this thread to `namespace` (and goals to `session`)."""
+    _NAMESPACE.set(namespace or "")
+    _SESSION.set(session if session is not None else namespace or "")
 
-# Working memory (session-scoped) for last 3 user goals
-_WORKING_GOALS: List[str] = []
+
+@contextmanager
+def use_namespace(namespace: str = "", session: Optional[str] = None):
+    """Scoped form of set_namespace (e.g. for background workers)."""
+    ns_token = _NAMESPACE.set(namespace or "")
+    session_token = _SESSION.set(session if session is not None else namespace or "")
+    try:
+        yield
+    finally:
+        _NAMESPACE.reset(ns_token)
+        _SESSION.reset(session_token)
+
+
+def current_namespace() -> str:
+    return _NAMESPACE.get()
+
+
+def collection_name_for(namespace: str = "") -> str:
+    """friday_memory for the shared namespace, friday_memory__<slug> otherwise."""
+    if not namespace:
+        return collection_name
+    slug = re.sub(r"[^A-Za-z0-9_-]", "-", namespace)[:40].strip("-_")
+    if slug != namespace:
+        slug = f"{slug}-{hashlib.md5(namespace.encode('utf-8')).hexdigest()[:8]}".lstrip("-")
+    return f"{collection_name}__{slug}"
+
+
+def get_embed_model():
+    """Process-wide embedding provider (see embeddings.py), loaded on first use"""
+    global _embed_model
+    if _embed_model is None:
+        with _INIT_LOCK:
+            if _embed_model is None:
+                from embeddings import load_provider
+                _embed_model = load_provider(MEMORY_CONFIG["embedding_model"], MEMORY_CONFIG["embedding"])
+    return _embed_model
+
+
+def get_client():
+    """Process-wide store client (persisted inside the src folder by default):
+    ChromaDB, or the in-process NumPy store when memory_config backend is "numpy"."""
+    global _client
+    if _client is None:
+        with _INIT_LOCK:
+            if _client is None:
+                if MEMORY_CONFIG.get("backend", "chroma") == "numpy":
+                    from vector_store import NumpyClient
+                    index = MEMORY_CONFIG["numpy_index"]
+                    _client = NumpyClient(SRC_PATH / MEMORY_CONFIG["numpy_path"],
+                                          quantization=index.get("quantization", "none"),
+                                          binary=bool(index.get("binary_prefilter", False)),
+                                          rerank_factor=int(index.get("rerank_factor", 4)))
+                else:
+                    import chromadb
+                    _client = chromadb.PersistentClient(path=str(SRC_PATH / MEMORY_CONFIG["chroma_path"]))
+    return _client
+
+
+def get_collection():
+    """The current namespace's memory collection, created on first use"""
+    namespace = _NAMESPACE.get()
+    with _INIT_LOCK:
+        col = _COLLECTIONS.get(namespace)
+        if col is None:
+            col = get_client().get_or_create_collection(collection_name_for(namespace))
+        _remember_namespace(_COLLECTIONS, namespace, col)
+    return col
+
+
+def prune_session_memory(max_age_hours: Optional[float] = None) -> int:
+    """Delete session-namespace collections with no memory written (or refreshed)
+    in the last `max_age_hours` (default memory_config session_ttl_hours).
+    Returns the number of collections removed."""
+    if max_age_hours is None:
+        max_age_hours = float(MEMORY_CONFIG["session_ttl_hours"])
+    cutoff = time.time() - max_age_hours * 3600
+    prefix = f"{collection_name}__{SESSION_PREFIX}"
+    removed = []
+    try:
+        client = get_client()
+        for col in client.list_collections():
+            name = getattr(col, "name", col)
+            if not name.startswith(prefix):
+                continue
+            recent = client.get_or_create_collection(name).get(where={"ts": {"$gte": cutoff}}, limit=1, include=[])
+            if not recent["ids"]:
+                client.delete_collection(name)
+                removed.append(name)
+    except Exception as e:
+        print("prune_session_memory err:", e)
+    if removed:
+        with _INIT_LOCK:
+            for namespace in [ns for ns in _COLLECTIONS if collection_name_for(ns) in removed]:
+                _COLLECTIONS.pop(namespace, None)
+                with _PINNED_LOCK:
+                    _PINNED_COUNTS.pop(namespace, None)
+                    _PINNED_MESSAGES.pop(namespace, None)
+                with _STATS_LOCK:
+                    _STATS_CACHE.pop(namespace, None)
+    return len(removed)
+
+
+def warmup_memory(background: bool = True):
+    """Load the embedding model and open the store ahead of the first chat turn.
+
+    With background=True this returns the started thread immediately.
+    """
+    def _run():
+        try:
+            if MEMORY_CONFIG.get("isolation") == "session":
+                prune_session_memory()
+            get_collection()
+            get_embed_model().encode("warmup")
+        except Exception as e:
+            print("warmup_memory err:", e)
+
+    if not background:
+        _run()
+        return None
+    t = threading.Thread(target=_run, name="memory-warmup", daemon=True)
+    t.start()
+    return t
+
+def _build_embed_cache() -> EmbeddingCache:
+    cfg = MEMORY_CONFIG["embedding_cache"]
+    disk = None
+    if cfg.get("disk_path"):
+        try:
+            disk = DiskVectorTier(SRC_PATH / cfg["disk_path"], capacity=cfg.get("disk_capacity", 100000))
+        except Exception as e:
+            print("embed cache disk tier disabled:", e)
+    return EmbeddingCache(max_entries=cfg.get("max_entries", 4096), disk=disk, dtype=cfg.get("dtype", "float32"))
+
+
+# Embedding cache for performance (bounded LRU, optional disk tier)
+_EMBED_CACHE = _build_embed_cache()
+
+# Cached number of pinned memories per namespace (missing = recount on next read)
+_PINNED_COUNTS: "OrderedDict[str, int]" = OrderedDict()
+# Cached pinned messages per namespace, dropped on pin/unpin/delete/clear
+_PINNED_MESSAGES: "OrderedDict[str, List[Dict]]" = OrderedDict()
+_PINNED_LOCK = threading.Lock()
+
+# Short-lived cache for get_memory_overview per namespace (invalidated on writes)
+STATS_TTL = 5.0
+_STATS_CACHE: "OrderedDict[str, tuple]" = OrderedDict()
+_STATS_LOCK = threading.Lock()
+
+# Working memory (session-scoped) for last 3 user goals; least recently used
+# sessions are forgotten beyond _MAX_GOAL_SESSIONS
+_WORKING_GOALS: "OrderedDict[str, List[str]]" = OrderedDict()
 _MAX_WORKING_GOALS = 3
+_MAX_GOAL_SESSIONS = 1024
+_GOALS_LOCK = threading.Lock()
 
 # Patterns for useful memory content
 IMPORTANT_PATTERNS = [
@@ -47,93 +287,288 @@ def is_useful_for_memory(text: str) -> bool:
     return len(text) <= 200 and text.endswith((".", "!", "?"))
 
 
-def embed(text: str):
-    """Cache embeddings for performance (cuts ~30–60ms)"""
+@timed("embed")
+def embed(text: str, exact: bool = False):
+    """Cache embeddings for performance (cuts ~30–60ms).
+    `exact` skips quantized cache entries (use it for vectors that get stored)."""
     key = hashlib.md5(text.encode("utf-8")).hexdigest()
-    if key in _EMBED_CACHE:
-        return _EMBED_CACHE[key]
-    v = embed_model.encode(text).tolist()
-    _EMBED_CACHE[key] = v
-    return v
+    v = _EMBED_CACHE.get(key, exact=exact)
+    if v is None:
+        v = _EMBED_CACHE.put(key, get_embed_model().encode(text))
+    return v.tolist()
+
+
+@timed("embed")
+def embed_many(texts: List[str], cache: bool = True, exact: bool = False) -> List[List[float]]:
+    """Embed many texts with a single encoder batch (cache hits are skipped).
+    `exact` returns full-precision vectors only, as in embed()."""
+    keys = [hashlib.md5(t.encode("utf-8")).hexdigest() for t in texts]
+    vecs = [_EMBED_CACHE.get(k, exact=exact) if cache else None for k in keys]
+    todo = [i for i, v in enumerate(vecs) if v is None]
+    if todo:
+        encoded = get_embed_model().encode([texts[i] for i in todo], batch_size=64)
+        for i, v in zip(todo, encoded):
+            vecs[i] = _EMBED_CACHE.put(keys[i], v) if cache else v
+    return [v.tolist() for v in vecs]
+
+
+def get_embed_cache_stats() -> Dict:
+    """Hit/miss/eviction counters for the embedding cache"""
+    return _EMBED_CACHE.stats()
 
 
 def push_working_goal(goal_text: str):
-    """Push a new user goal to working memory (front), trim to last 3."""
-    global _WORKING_GOALS
+    """Push a new user goal to this session's working memory (front), trim to last 3."""
     goal_text = goal_text.strip()
     if not goal_text:
         return
-    # de-dup simple
-    _WORKING_GOALS = [g for g in _WORKING_GOALS if g.lower() != goal_text.lower()]
-    _WORKING_GOALS.insert(0, goal_text)
-    if len(_WORKING_GOALS) > _MAX_WORKING_GOALS:
-        _WORKING_GOALS = _WORKING_GOALS[:_MAX_WORKING_GOALS]
+    session = _SESSION.get()
+    with _GOALS_LOCK:
+        # de-dup simple
+        goals = [g for g in _WORKING_GOALS.get(session, []) if g.lower() != goal_text.lower()]
+        _WORKING_GOALS[session] = [goal_text] + goals[:_MAX_WORKING_GOALS - 1]
+        _WORKING_GOALS.move_to_end(session)
+        while len(_WORKING_GOALS) > _MAX_GOAL_SESSIONS:
+            _WORKING_GOALS.popitem(last=False)
 
 
 def list_working_goals() -> List[str]:
-    return list(_WORKING_GOALS)
+    with _GOALS_LOCK:
+        return list(_WORKING_GOALS.get(_SESSION.get(), []))
 
 
 def clear_working_goals():
-    _WORKING_GOALS.clear()
+    with _GOALS_LOCK:
+        _WORKING_GOALS.pop(_SESSION.get(), None)
+
+
+_NORM_RE = re.compile(r"[^\w\s]+")
+
+
+def norm_hash(text: str) -> str:
+    """Hash of the text with case, punctuation and spacing normalized away."""
+    norm = " ".join(_NORM_RE.sub(" ", text.lower()).split())
+    return hashlib.sha1(norm.encode("utf-8")).hexdigest()[:16]
+
+
+# Neighbours checked per message; summaries share the assistant role and may rank first
+NEAR_DUP_CANDIDATES = 3
+
+
+def _find_duplicates(items: List[Dict], hashes: List[str], vecs: List[List[float]]) -> Dict[int, str]:
+    """Map item index -> ID of an existing record it repeats (same role).
+
+    Exact repeats are found by norm_hash in one metadata lookup; the rest by one
+    batched nearest-neighbour query per role (a few neighbours each, summaries
+    skipped), matching at cosine >= dedupe.near_threshold.
+    """
+    col = get_collection()
+    if col.count() == 0:
+        return {}
+    found = {}
+    res = col.get(where={"norm_hash": {"$in": sorted(set(hashes))}}, include=["metadatas"])
+    existing = {(m.get("role"), m.get("norm_hash")): mid for mid, m in zip(res["ids"], res["metadatas"]) if m}
+    for i, m in enumerate(items):
+        mid = existing.get((m["role"], hashes[i]))
+        if mid:
+            found[i] = mid
+    threshold = float(MEMORY_CONFIG["dedupe"].get("near_threshold", 1.0))
+    todo = [i for i in range(len(items)) if i not in found]
+    if not todo or threshold >= 1.0:
+        return found
+    for role in sorted({items[i]["role"] for i in todo}):
+        batch = [i for i in todo if items[i]["role"] == role]
+        res = col.query(query_embeddings=[vecs[i] for i in batch], n_results=NEAR_DUP_CANDIDATES,
+                        where={"role": role}, include=["metadatas", "embeddings"])
+        for i, ids, metas, embs in zip(batch, res["ids"], res["metadatas"], res["embeddings"]):
+            for mid, meta, emb in zip(ids, metas, embs):
+                if (meta or {}).get("type") == "summary":
+                    continue
+                # Stored vectors are unit-norm, so the dot product is the cosine
+                if float(np.dot(vecs[i], emb)) >= threshold:
+                    found[i] = mid
+                break
+    return found
+
+
+def _refresh_duplicates(found: Dict[int, str], items: List[Dict], now: float):
+    """Bump ts and hit count on the records that absorbed repeats."""
+    col = get_collection()
+    ids = sorted(set(found.values()))
+    res = col.get(ids=ids, include=["metadatas"])
+    metas = {mid: (m or {}) for mid, m in zip(res["ids"], res["metadatas"])}
+    updates = {}
+    for i, mid in found.items():
+        if mid not in metas:
+            continue
+        meta = updates.get(mid) or {"ts": float(metas[mid].get("ts", 0.0)), "hits": int(metas[mid].get("hits", 1))}
+        meta["ts"] = max(meta["ts"], float(items[i].get("ts", now)))
+        meta["hits"] += 1
+        updates[mid] = meta
+    if updates:
+        # Chroma merges metadata on update, so pins and tags are kept
+        col.update(ids=list(updates), metadatas=list(updates.values()))
+
+
+_ID_LOCK = threading.Lock()
+_LAST_ID_MS = 0
+_ID_SEQ = 0
+
+
+def make_memory_id(role: str, content: str, ts: Optional[float] = None) -> str:
+    """`{role}_{ms:013d}{seq:04x}_{hash12}`: sortable by time, unique per process.
+
+    With an explicit `ts` the ID is deterministic (seq 0) so re-importing the same
+    message maps onto the same record; otherwise a per-millisecond counter keeps
+    IDs strictly increasing even when the clock stalls or steps back.
+    """
+    digest = hashlib.sha1(f"{role}\0{content}".encode("utf-8")).hexdigest()[:12]
+    if ts is not None:
+        return f"{role}_{int(ts * 1000):013d}0000_{digest}"
+    global _LAST_ID_MS, _ID_SEQ
+    with _ID_LOCK:
+        ms = int(time.time() * 1000)
+        if ms <= _LAST_ID_MS:
+            ms, _ID_SEQ = _LAST_ID_MS, _ID_SEQ + 1
+            if _ID_SEQ > 0xFFFF:
+                ms, _ID_SEQ = ms + 1, 1
+        else:
+            _ID_SEQ = 1
+        _LAST_ID_MS = ms
+        return f"{role}_{ms:013d}{_ID_SEQ:04x}_{digest}"
 
 
 def save_message(role, content):
     """Save a message to ChromaDB memory (filtered for usefulness)"""
+    return save_messages([{"role": role, "content": content}]) == 1
+
+
+def save_messages(messages: Iterable[Dict], filter_useful: bool = True, cache: bool = True,
+                  dedupe: Optional[bool] = None) -> int:
+    """Save many messages with one embedding batch and one get_collection().upsert.
+
+    Each item is {"role", "content"} with an optional "ts" or "id". Items with a
+    ts (or id) get deterministic IDs, so retrying or re-importing them rewrites
+    the same records instead of duplicating them. With dedupe (memory_config
+    dedupe.enabled by default) a message that repeats a stored one, exactly or
+    nearly, refreshes that record's ts and hits instead of adding a new one.
+    Returns the number of messages stored or merged.
+    """
     try:
-        if not is_useful_for_memory(content):
-            return False
-        vec = embed(content)
-        mid = f"{role}_{int(time.time()*1000)}"
-        collection.add(
-            documents=[content],
-            metadatas=[{"role": role, "ts": time.time()}],
-            ids=[mid],
-            embeddings=[vec],
-        )
-        return True
+        items = [m for m in messages if m.get("content")]
+        if filter_useful:
+            items = [m for m in items if is_useful_for_memory(m["content"])]
+        if not items:
+            return 0
+        if dedupe is None:
+            dedupe = bool(MEMORY_CONFIG["dedupe"].get("enabled", True))
+        handled = len(items)
+        # Keyed by ID (and normalized text when deduping): repeats inside one
+        # batch collapse into a single record
+        by_key = {}
+        for m in items:
+            mid = m.get("id") or make_memory_id(m["role"], m["content"], m.get("ts"))
+            key = (m["role"], norm_hash(m["content"])) if dedupe and not m.get("id") else mid
+            by_key[key] = (mid, m)
+        ids = [mid for mid, _ in by_key.values()]
+        items = [m for _, m in by_key.values()]
+        hashes = [norm_hash(m["content"]) for m in items]
+        vecs = embed_many([m["content"] for m in items], cache=cache, exact=True)
+        now = time.time()
+        if dedupe:
+            # A record matching its own ID is a retry/re-import: plain upsert
+            found = {i: mid for i, mid in _find_duplicates(items, hashes, vecs).items() if mid != ids[i]}
+            if found:
+                _refresh_duplicates(found, items, now)
+                keep = [i for i in range(len(items)) if i not in found]
+                ids, items, hashes, vecs = ([seq[i] for i in keep] for seq in (ids, items, hashes, vecs))
+        if items:
+            get_collection().upsert(
+                documents=[m["content"] for m in items],
+                metadatas=[{"role": m["role"], "ts": float(m.get("ts", now)), "norm_hash": h}
+                           for m, h in zip(items, hashes)],
+                ids=ids,
+                embeddings=vecs,
+            )
+        _invalidate_stats()
+        return handled
     except Exception as e:
-        print("save_message err:", e)
-        return False
+        print("save_messages err:", e)
+        return 0
 
 
+@timed("retrieve_memory")
 def retrieve_memory(query, top_k=3):
-    """Retrieve relevant past messages with recency + relevance scoring"""
+    """Retrieve relevant past messages ranked by similarity, recency, pins and type (see ranking.py)"""
     try:
+        cfg = MEMORY_CONFIG["ranking"]
         qv = embed(query)
-        res = collection.query(query_embeddings=[qv], n_results=min(top_k*4, 12))
+        res = get_collection().query(
+            query_embeddings=[qv],
+            n_results=max(top_k, int(cfg.get("candidates", 12))),
+            include=["documents", "metadatas", "distances", "embeddings"],
+        )
+        ids = res.get("ids", [[]])[0]
         docs = res.get("documents", [[]])[0]
         metas = res.get("metadatas", [[]])[0]
-        scored = []
-        now = time.time()
-        for i, d in enumerate(docs):
-            age_sec = max(1.0, now - metas[i].get("ts", now))
-            recency = 1.0 / (1.0 + age_sec/86400.0)
-            brevity = 1.0 / (1 + max(0, len(d) - 160)/160)
-            score = 1.0 * recency + 0.3 * brevity
-            scored.append((score, metas[i], d))
-        scored.sort(key=lambda x: x[0], reverse=True)
-        out = [{"role": m.get("role","user"), "content": d} for (s,m,d) in scored[:top_k]]
-        return out
+        dists = (res.get("distances") or [[None] * len(ids)])[0]
+        embs = res.get("embeddings")
+        embs = embs[0] if embs is not None else [None] * len(ids)
+        candidates = [
+            {"id": ids[i], "document": docs[i], "metadata": metas[i] or {}, "distance": dists[i], "embedding": embs[i]}
+            for i in range(len(ids))
+        ]
+        ranked = rank(qv, candidates, top_k, cfg)
+        return [{"role": c["metadata"].get("role", "user"), "content": c["document"]} for c in ranked]
     except Exception as e:
         print("retrieve_memory err:", e)
         return []
 
 
-def get_memory_stats():
-    """Get basic stats about stored memory"""
+def _invalidate_stats():
+    with _STATS_LOCK:
+        _STATS_CACHE.pop(_NAMESPACE.get(), None)
+
+
+def get_memory_overview() -> Dict:
+    """Counts in one call: total, user, assistant, summaries, pinned.
+
+    Cached for STATS_TTL seconds and dropped on every write, so a Streamlit
+    rerun reads it from memory instead of querying Chroma again.
+    """
+    namespace = _NAMESPACE.get()
+    with _STATS_LOCK:
+        cached = _STATS_CACHE.get(namespace)
+        if cached and time.time() - cached[0] < STATS_TTL:
+            return dict(cached[1])
     try:
-        count = collection.count()
-        return count
+        col = get_collection()
+        summaries = len(col.get(where={"type": "summary"}, include=[])["ids"])
+        assistant = len(col.get(where={"role": "assistant"}, include=[])["ids"])
+        overview = {
+            "total": col.count(),
+            "user": len(col.get(where={"role": "user"}, include=[])["ids"]),
+            "assistant": assistant - summaries,
+            "summaries": summaries,
+            "pinned": get_pinned_count(),
+        }
     except Exception as e:
         print(f"Error getting memory stats: {e}")
-        return 0
+        return {"total": 0, "user": 0, "assistant": 0, "summaries": 0, "pinned": 0}
+    with _STATS_LOCK:
+        _remember_namespace(_STATS_CACHE, namespace, (time.time(), overview))
+    return dict(overview)
+
+
+def get_memory_stats():
+    """Get basic stats about stored memory"""
+    return get_memory_overview()["total"]
 
 
 def get_all_messages(limit=10):
     """Get all stored messages for inspection"""
     try:
-        results = collection.get(limit=limit)
+        results = get_collection().get(limit=limit)
         messages = []
         for i in range(len(results['ids'])):
             metadata = results['metadatas'][i]
@@ -155,7 +590,7 @@ def generate_tags_for_conversation(conversation_text: str) -> List[str]:
     """Generate tags for conversation using LLM"""
     try:
         tag_prompt = f"Generate 3-5 relevant tags for this conversation (comma-separated):\n{conversation_text[:500]}"
-        from .llm_utils import query_ollama
+        from llm_utils import query_ollama
         tags_response = query_ollama(tag_prompt)
         tags = [tag.strip() for tag in tags_response.split(',') if tag.strip()]
         return tags[:5]
@@ -165,13 +600,16 @@ def generate_tags_for_conversation(conversation_text: str) -> List[str]:
 
 
 def clear_all_memory():
-    """Clear all stored memory"""
+    """Clear all memory stored in the current namespace"""
     try:
-        client.delete_collection(collection_name)
-        global collection
-        collection = client.create_collection(collection_name)
-        global _EMBED_CACHE
+        namespace = _NAMESPACE.get()
+        name = collection_name_for(namespace)
+        with _INIT_LOCK:
+            get_collection()  # make sure it exists before dropping it
+            get_client().delete_collection(name)
+            _remember_namespace(_COLLECTIONS, namespace, get_client().create_collection(name))
         _EMBED_CACHE.clear()
+        _invalidate_pinned_count()
         clear_working_goals()
         return True
     except Exception as e:
@@ -179,10 +617,31 @@ def clear_all_memory():
         return False
 
 
+def _invalidate_pinned_count():
+    with _PINNED_LOCK:
+        _PINNED_COUNTS.pop(_NAMESPACE.get(), None)
+        _PINNED_MESSAGES.pop(_NAMESPACE.get(), None)
+    _invalidate_stats()
+
+
+def _adjust_pinned_count(delta: int):
+    namespace = _NAMESPACE.get()
+    with _PINNED_LOCK:
+        _PINNED_MESSAGES.pop(namespace, None)
+        if namespace in _PINNED_COUNTS:
+            _PINNED_COUNTS[namespace] = max(0, _PINNED_COUNTS[namespace] + delta)
+    _invalidate_stats()
+
+
 def delete_message_by_id(message_id: str):
     """Delete a specific message by ID"""
     try:
-        collection.delete(ids=[message_id])
+        result = get_collection().get(ids=[message_id], include=["metadatas"])
+        was_pinned = bool(result["metadatas"] and (result["metadatas"][0] or {}).get("pinned"))
+        get_collection().delete(ids=[message_id])
+        if was_pinned:
+            _adjust_pinned_count(-1)
+        _invalidate_stats()
         return True
     except Exception as e:
         print("delete_message_by_id err:", e)
@@ -192,18 +651,15 @@ def delete_message_by_id(message_id: str):
 def pin_message(message_id: str, pin_note: str = ""):
     """Pin a message with optional note"""
     try:
-        result = collection.get(ids=[message_id])
-        if not result.get("documents"):
+        result = get_collection().get(ids=[message_id], include=["metadatas"])
+        if not result.get("ids"):
             return False
-        collection.update(
-            ids=[message_id],
-            metadatas=[{
-                "role": result["metadatas"][0]["role"],
-                "ts": result["metadatas"][0]["ts"],
-                "pinned": True,
-                "pin_note": pin_note
-            }]
-        )
+        metadata = dict(result["metadatas"][0] or {})
+        was_pinned = bool(metadata.get("pinned"))
+        metadata.update(pinned=True, pin_note=pin_note)
+        get_collection().update(ids=[message_id], metadatas=[metadata])
+        if not was_pinned:
+            _adjust_pinned_count(1)
         return True
     except Exception as e:
         print("pin_message err:", e)
@@ -213,13 +669,16 @@ def pin_message(message_id: str, pin_note: str = ""):
 def unpin_message(message_id: str):
     """Unpin a message"""
     try:
-        result = collection.get(ids=[message_id])
-        if not result.get("documents"):
+        result = get_collection().get(ids=[message_id], include=["metadatas"])
+        if not result.get("ids"):
             return False
-        metadata = result["metadatas"][0].copy()
-        metadata.pop("pinned", None)
-        metadata.pop("pin_note", None)
-        collection.update(ids=[message_id], metadatas=[metadata])
+        metadata = dict(result["metadatas"][0] or {})
+        was_pinned = bool(metadata.get("pinned"))
+        # Chroma merges metadata on update, so the flag must be set, not dropped
+        metadata.update(pinned=False, pin_note="")
+        get_collection().update(ids=[message_id], metadatas=[metadata])
+        if was_pinned:
+            _adjust_pinned_count(-1)
         return True
     except Exception as e:
         print("unpin_message err:", e)
@@ -227,65 +686,239 @@ def unpin_message(message_id: str):
 
 
 def get_pinned_messages():
-    """Get all pinned messages"""
+    """Get all pinned messages (server-side metadata filter, O(pinned); cached
+    until the next pin/unpin/delete)"""
+    namespace = _NAMESPACE.get()
+    cached = _PINNED_MESSAGES.get(namespace)
+    if cached is not None:
+        return [dict(m) for m in cached]
     try:
-        results = collection.get()
+        results = get_collection().get(where={"pinned": True}, include=["documents", "metadatas"])
         pinned = []
         for i in range(len(results['ids'])):
             metadata = results['metadatas'][i]
-            if metadata.get('pinned'):
-                pinned.append({
-                    'id': results['ids'][i],
-                    'content': results['documents'][i],
-                    'role': metadata['role'],
-                    'timestamp': metadata.get('ts', time.time()),
-                    'pin_note': metadata.get('pin_note', '')
-                })
+            pinned.append({
+                'id': results['ids'][i],
+                'content': results['documents'][i],
+                'role': metadata['role'],
+                'timestamp': metadata.get('ts', time.time()),
+                'pin_note': metadata.get('pin_note', '')
+            })
+        with _PINNED_LOCK:
+            _remember_namespace(_PINNED_COUNTS, namespace, len(pinned))
+            _remember_namespace(_PINNED_MESSAGES, namespace, [dict(m) for m in pinned])
         return pinned
     except Exception as e:
         print("get_pinned_messages err:", e)
         return []
 
 
-def summarize_and_compact(limit=40):
-    """Periodic compaction to keep DB small & fast with smart tagging"""
+def get_pinned_count() -> int:
+    """Number of pinned messages; cached and kept current by pin/unpin/delete"""
+    namespace = _NAMESPACE.get()
+    n = _PINNED_COUNTS.get(namespace)
+    if n is None:
+        try:
+            n = len(get_collection().get(where={"pinned": True}, include=[])["ids"])
+        except Exception as e:
+            print("get_pinned_count err:", e)
+            return 0
+        with _PINNED_LOCK:
+            _remember_namespace(_PINNED_COUNTS, namespace, n)
+    return n
+
+
+def _compaction_candidates():
+    """Split unpinned memories into (messages, summaries), oldest first.
+    Metadata-only scan; runs on the background compaction worker."""
+    res = get_collection().get(include=["metadatas"])
+    messages, summaries = [], []
+    for mid, meta in zip(res["ids"], res["metadatas"]):
+        meta = meta or {}
+        if meta.get("pinned"):
+            continue
+        (summaries if meta.get("type") == "summary" else messages).append((meta.get("ts", 0.0), mid))
+    messages.sort()
+    summaries.sort()
+    return [m for _, m in messages], [m for _, m in summaries]
+
+
+def _finish_interrupted_compactions() -> int:
+    """Delete sources that a previous run summarized but did not get to remove."""
+    res = get_collection().get(where={"type": "summary"}, include=["metadatas"])
+    sources = []
+    for meta in res["metadatas"]:
+        sources.extend(json.loads((meta or {}).get("source_ids") or "[]"))
+    if not sources:
+        return 0
+    leftover = get_collection().get(ids=sources, include=["metadatas"])
+    stale = [mid for mid, meta in zip(leftover["ids"], leftover["metadatas"]) if not (meta or {}).get("pinned")]
+    if stale:
+        get_collection().delete(ids=stale)
+    return len(stale)
+
+
+# Structured output for compaction: summary bullets and tags in one LLM call
+COMPACTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "bullets": {"type": "array", "items": {"type": "string"}, "minItems": 1, "maxItems": 8},
+        "tags": {"type": "array", "items": {"type": "string"}, "maxItems": 5},
+    },
+    "required": ["bullets", "tags"],
+}
+
+
+SUMMARY_PROMPT = (
+    "Summarize these points into at most 8 crisp bullets of lasting facts, "
+    "and give 3-5 short topic tags. Reply as JSON with keys \"bullets\" and \"tags\".\n"
+)
+
+
+def _summary_input_budget() -> int:
+    """Tokens left for the points: num_ctx minus reply room and the instructions."""
+    from context import RESPONSE_RESERVE, TEMPLATE_OVERHEAD, count_tokens
+    from llm_utils import DEFAULT_OPTIONS
+    return DEFAULT_OPTIONS["num_ctx"] - RESPONSE_RESERVE - TEMPLATE_OVERHEAD - count_tokens(SUMMARY_PROMPT)
+
+
+def _as_points(meta: Dict, doc: str) -> str:
+    """A summary's bullets pass through unchanged; a message becomes one bullet."""
+    return doc if meta.get("type") == "summary" else f"- {doc}"
+
+
+def _summarize_chunk(points: List[str]):
+    """Returns (summary, tags) from a single JSON-format request, or (None, []) on failure."""
+    summary_prompt = SUMMARY_PROMPT + "\n".join(points)
+    from llm_utils import query_ollama_json
+    out = query_ollama_json(summary_prompt, COMPACTION_SCHEMA, opts={"stop": []})
+    if not out:
+        return None, []
+    bullets = [b.strip() for b in out["bullets"] if b.strip()]
+    tags = [t.strip() for t in out["tags"] if t.strip()][:5]
+    return ("\n".join(f"- {b}" for b in bullets) or None), tags
+
+
+def _replace_with_summary(ids: List[str]) -> Tuple[int, int]:
+    """Summarize the longest prefix of `ids` (oldest first) whose full text fits
+    the model context into one summary document, then delete those sources.
+
+    Documents are never cut: the chunk shrinks instead, and a document too long
+    to share a chunk is left in place. Returns (ids consumed, docs removed).
+    The summary is written first and records its source IDs, so an interrupted run
+    never loses data and is finished by _finish_interrupted_compactions.
+    """
+    from context import count_tokens
+
+    res = get_collection().get(ids=ids, include=["documents", "metadatas"])
+    found = {i: ((m or {}), d) for i, d, m in zip(res["ids"], res["documents"], res["metadatas"])}
+    budget = _summary_input_budget()
+    rows, used, tokens = [], 0, 0
+    for mid in ids:
+        meta, doc = found.get(mid, ({"pinned": True}, ""))
+        if not meta.get("pinned"):
+            cost = count_tokens(_as_points(meta, doc)) + 1
+            if rows and tokens + cost > budget:
+                break
+            rows.append((meta, doc, mid))
+            tokens += cost
+        used += 1
+    if len(rows) < 2:
+        # Nothing to fold, or the next document alone fills the context: skip past it
+        return used, 0
+    rows.sort(key=lambda r: r[0].get("ts", 0.0))
+    src_ids = [i for _, _, i in rows]
+    summary, tags = _summarize_chunk([_as_points(m, d) for m, d, _ in rows])
+    if not summary:
+        print("summarize_and_compact: no valid summary, keeping sources")
+        return used, 0
+    level = 1 + max(int(m.get("level", 0)) for m, _, _ in rows)
+    # Deterministic ID (sources + period end): a retried run rewrites the same summary
+    get_collection().upsert(
+        documents=[summary],
+        metadatas=[{
+            "role": "assistant",
+            "ts": rows[-1][0].get("ts", time.time()),
+            "type": "summary",
+            "tags": ",".join(tags),
+            "level": level,
+            "period_start": rows[0][0].get("ts", 0.0),
+            "source_ids": json.dumps(src_ids),
+            "source_count": len(src_ids),
+        }],
+        ids=[make_memory_id("summary", "\n".join(src_ids), rows[-1][0].get("ts", 0.0))],
+        embeddings=[embed(summary, exact=True)]
+    )
+    # Re-check pins right before deleting: a source pinned meanwhile is kept
+    current = get_collection().get(ids=src_ids, include=["metadatas"])
+    doomed = [i for i, m in zip(current["ids"], current["metadatas"]) if not (m or {}).get("pinned")]
+    if doomed:
+        get_collection().delete(ids=doomed)
+    return used, len(doomed)
+
+
+def summarize_and_compact(limit=None) -> int:
+    """Compaction that keeps the DB bounded: the oldest unpinned messages beyond
+    compaction.max_messages are summarized in chunks and replaced by the summary;
+    summaries beyond compaction.max_summaries are merged the same way.
+
+    `limit` forces up to that many messages to be compacted regardless of the
+    threshold. Returns the number of documents removed (run it via
+    compaction.request_compaction).
+    """
     try:
-        res = collection.get(limit=limit)
-        if not res.get("documents"):
-            return
-        docs = res["documents"]
-        if len(docs) < limit:
-            return
-        conversation_text = "\n".join(docs[-limit:])
-        tags = generate_tags_for_conversation(conversation_text)
-        points = "\n".join(f"- {d[:140]}" for d in docs[-limit:])
-        summary_prompt = f"Summarize these points into 8 crisp bullets of lasting facts:\n{points}\nSummary:"
-        from .llm_utils import stream_ollama
-        summary = "".join(tok for tok in stream_ollama(summary_prompt))
-        collection.add(
-            documents=[summary],
-            metadatas=[{
-                "role":"assistant",
-                "ts": time.time(),
-                "type":"summary",
-                "tags": ",".join(tags)
-            }],
-            ids=[f"summary_{int(time.time()*1000)}"],
-            embeddings=[embed(summary)]
-        )
+        cfg = MEMORY_CONFIG["compaction"]
+        chunk = max(2, int(cfg["chunk_size"]))
+        compacted = _finish_interrupted_compactions()
+
+        messages, summaries = _compaction_candidates()
+        eligible = messages[:max(0, len(messages) - int(cfg["keep_recent"]))]
+        if limit is not None:
+            budget = min(int(limit), len(eligible))
+        elif len(messages) > int(cfg["max_messages"]):
+            budget = min(len(eligible), chunk * int(cfg["max_chunks"]))
+        else:
+            budget = 0
+        start = 0
+        while start < budget:
+            used, removed = _replace_with_summary(eligible[start:min(start + chunk, budget)])
+            compacted += removed
+            start += max(1, used)
+
+        # Second level: fold the oldest summaries into one
+        _, summaries = _compaction_candidates()
+        excess = len(summaries) - int(cfg["max_summaries"])
+        if excess > 0:
+            compacted += _replace_with_summary(summaries[:max(excess + 1, 2)][:chunk])[1]
+        _invalidate_stats()
+        return compacted
     except Exception as e:
         print("summarize_and_compact err:", e)
+        return 0
+
+
+def get_summary_sources(summary_id: str) -> List[str]:
+    """IDs of the memories a summary replaced"""
+    try:
+        res = get_collection().get(ids=[summary_id], include=["metadatas"])
+        if not res["ids"]:
+            return []
+        return json.loads((res["metadatas"][0] or {}).get("source_ids") or "[]")
+    except Exception as e:
+        print("get_summary_sources err:", e)
+        return []
 
 
 def forget_by_text(query_text: str, top_k: int = 5) -> int:
     """Delete up to top_k semantically similar memories to query_text. Returns count deleted."""
     try:
         qv = embed(query_text)
-        res = collection.query(query_embeddings=[qv], n_results=top_k)
+        res = get_collection().query(query_embeddings=[qv], n_results=top_k)
         ids = res.get('ids', [[]])[0]
         if not ids:
             return 0
-        collection.delete(ids=ids)
+        get_collection().delete(ids=ids)
+        _invalidate_pinned_count()
         return len(ids)
     except Exception as e:
         print("forget_by_text err:", e)
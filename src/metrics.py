@@ -0,0 +1,101 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+# Local metrics sink (one JSON object per line), off by default; app.py points it
+# at DEFAULT_METRICS_PATH when ui_preferences save_metrics is on (Settings tab)
+DEFAULT_METRICS_PATH = Path(__file__).resolve().parent / "metrics.jsonl"
+METRICS_PATH: Optional[Path] = None
+# The file is rotated to <name>.1 (one backup kept) once it grows past this
+METRICS_MAX_BYTES = 5 * 1024 * 1024
+
+_HOOKS: List[Callable[[Dict], None]] = []
+_WRITE_LOCK = threading.Lock()
+
+# Collector for the chat turn running on this thread/task (see turn())
+_TURN: ContextVar[Optional[Dict]] = ContextVar("friday_turn", default=None)
+
+
+def add_hook(fn: Callable[[Dict], None]):
+    """Register a callable that receives every metrics event as a dict."""
+    _HOOKS.append(fn)
+
+
+def remove_hook(fn: Callable[[Dict], None]):
+    if fn in _HOOKS:
+        _HOOKS.remove(fn)
+
+
+def emit(event: str, persist: bool = True, **fields) -> Dict:
+    """Send an event to the hooks and (if persist) append it to METRICS_PATH."""
+    record = {"event": event, "ts": time.time(), **fields}
+    for hook in list(_HOOKS):
+        try:
+            hook(record)
+        except Exception as e:
+            print("metrics hook err:", e)
+    if persist and METRICS_PATH is not None:
+        try:
+            line = json.dumps(record, default=str)
+            with _WRITE_LOCK:
+                _rotate(Path(METRICS_PATH))
+                with open(METRICS_PATH, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+        except Exception as e:
+            print("metrics write err:", e)
+    return record
+
+
+def _rotate(path: Path):
+    try:
+        if path.stat().st_size >= METRICS_MAX_BYTES:
+            os.replace(path, path.with_name(path.name + ".1"))
+    except FileNotFoundError:
+        pass
+
+
+@contextmanager
+def span(name: str):
+    """Time a stage; durations are summed into the current turn and sent to hooks."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        ms = (time.perf_counter() - start) * 1000.0
+        current = _TURN.get()
+        if current is not None:
+            spans = current["spans"]
+            spans[name] = spans.get(name, 0.0) + ms
+        emit("span", persist=False, name=name, ms=ms)
+
+
+def timed(name: str):
+    """Decorator form of span()."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+@contextmanager
+def turn(**fields):
+    """Collect spans (and anything the caller adds) for one chat turn; the
+    record is emitted and persisted when the block exits."""
+    record = {"spans": {}, **fields}
+    token = _TURN.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        _TURN.reset(token)
+        record["total_ms"] = (time.perf_counter() - start) * 1000.0
+        emit("turn", **record)
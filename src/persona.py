@@ -1,18 +1,24 @@
+import copy
+import hashlib
+import threading
 import yaml
 import re
-from typing import Dict, List, Optional
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 
+from metrics import timed
 
-def load_persona_config(root_path: Optional[Path] = None):
-    """Load persona configuration from src/config; fall back to defaults."""
+
+def _persona_config_path(root_path: Optional[Path] = None) -> Path:
     base = root_path if root_path else Path(__file__).resolve().parent.parent
-    cfg_path = base / 'src' / 'config' / 'persona_config.yaml'
-    try:
-        with open(cfg_path, 'r') as file:
-            return yaml.safe_load(file)
-    except FileNotFoundError:
-        return get_default_config()
+    return base / 'src' / 'config' / 'persona_config.yaml'
+
+
+def load_persona_config(root_path: Optional[Path] = None):
+    """Load persona configuration from src/config; fall back to defaults.
+    Parsed once and reloaded only when the file changes (see get_persona_engine)."""
+    return copy.deepcopy(get_persona_engine(root_path).config)
 
 
 def get_default_config():
@@ -29,26 +35,59 @@ def get_default_config():
     }
 
 
-# Sentiment detection patterns
-SENTIMENT_PATTERNS = {
-    'sad': [r'\b(sad|depressed|down|blue|unhappy|miserable|hopeless)\b', r'\b(crying|tears|😢|😭|💔)\b'],
-    'angry': [r'\b(angry|mad|furious|irritated|annoyed|frustrated|pissed|rage|😠|😡|🤬)\b', r'\b(hate|dislike|terrible|awful|horrible|frustrating)\b'],
-    'playful': [r'\b(fun|joke|lol|haha|😄|😆|😂)\b', r'\b(playful|silly|goofy|funny)\b'],
-    'stressed': [r'\b(stressed|overwhelmed|anxious|worried|panic|😰|😨|😱)\b', r'\b(deadline|pressure|urgent|rush)\b'],
-    'focused': [r'\b(focus|concentrate|serious|important|critical)\b', r'\b(work|task|project|deadline)\b']
+# Sentiment keywords (words match on word boundaries, emoji anywhere)
+SENTIMENT_KEYWORDS = {
+    'sad': ['sad', 'depressed', 'down', 'blue', 'unhappy', 'miserable', 'hopeless', 'crying', 'tears', '😢', '😭', '💔'],
+    'angry': ['angry', 'mad', 'furious', 'irritated', 'annoyed', 'frustrated', 'pissed', 'rage', '😠', '😡', '🤬',
+              'hate', 'dislike', 'terrible', 'awful', 'horrible', 'frustrating'],
+    'playful': ['fun', 'joke', 'lol', 'haha', '😄', '😆', '😂', 'playful', 'silly', 'goofy', 'funny'],
+    'stressed': ['stressed', 'overwhelmed', 'anxious', 'worried', 'panic', '😰', '😨', '😱',
+                 'deadline', 'pressure', 'urgent', 'rush'],
+    'focused': ['focus', 'concentrate', 'serious', 'important', 'critical', 'work', 'task', 'project', 'deadline']
 }
 
+# Tie-break order when moods score equally (most sensitive first)
+SENTIMENT_PRIORITY = ('sad', 'angry', 'stressed', 'playful', 'focused')
 
-def detect_sentiment(text: str) -> str:
-    """Detect user sentiment from text patterns"""
-    text_lower = text.lower()
 
-    for sentiment, patterns in SENTIMENT_PATTERNS.items():
-        for pattern in patterns:
-            if re.search(pattern, text_lower, re.IGNORECASE):
-                return sentiment
+def _compile_sentiment_matcher():
+    """One alternation over every keyword + a keyword -> moods lookup table."""
+    keyword_moods: Dict[str, List[str]] = {}
+    for mood, words in SENTIMENT_KEYWORDS.items():
+        for w in words:
+            keyword_moods.setdefault(w.lower(), []).append(mood)
+    words = sorted((k for k in keyword_moods if k.isalnum()), key=len, reverse=True)
+    symbols = sorted((k for k in keyword_moods if not k.isalnum()), key=len, reverse=True)
+    pattern = r"\b(?:" + "|".join(map(re.escape, words)) + r")\b"
+    if symbols:
+        pattern += "|" + "|".join(map(re.escape, symbols))
+    return re.compile(pattern, re.IGNORECASE), keyword_moods
 
-    return 'default'
+
+_SENTIMENT_RE, _KEYWORD_MOODS = _compile_sentiment_matcher()
+
+
+@lru_cache(maxsize=1024)
+def classify_sentiment(text: str) -> Tuple[str, float]:
+    """Score every mood in one pass over the text.
+
+    Returns (mood, confidence) where confidence is the mood's share of all
+    keyword hits; ('default', 0.0) when nothing matches.
+    """
+    scores = dict.fromkeys(SENTIMENT_PRIORITY, 0)
+    for match in _SENTIMENT_RE.finditer(text):
+        for mood in _KEYWORD_MOODS[match.group(0).lower()]:
+            scores[mood] += 1
+    total = sum(scores.values())
+    if not total:
+        return 'default', 0.0
+    best = max(SENTIMENT_PRIORITY, key=lambda m: (scores[m], -SENTIMENT_PRIORITY.index(m)))
+    return best, scores[best] / total
+
+
+def detect_sentiment(text: str) -> str:
+    """Detect user sentiment from text patterns"""
+    return classify_sentiment(text)[0]
 
 
 def _format_depth_sections() -> str:
@@ -62,80 +101,128 @@ def _format_depth_sections() -> str:
     )
 
 
-def generate_adaptive_prompt(user_input: str, config: Dict = None) -> str:
-    """Generate adaptive persona prompt based on friday_v2 schema with tone and depth."""
-    if config is None:
-        config = load_persona_config()
+# Requests for depth switch on the sectioned answer template
+_DEPTH_RE = re.compile(r"(deep|details|explain|long|in\s*depth|comprehensive|more detail)", re.I)
 
-    # Support both old and new schema gracefully
-    persona_cfg = config.get('persona', {})
-    name = persona_cfg.get('name', 'FRIDAY')
-    respect_title = persona_cfg.get('respect_title') or persona_cfg.get('core', {}).get('primary_address', 'Exynos Thinkers')
 
-    # Traits/signature (new schema encodes weights; render names only)
-    traits_list = []
-    for item in persona_cfg.get('traits', []):
-        if isinstance(item, dict):
-            for k in item.keys():
-                traits_list.append(k)
-        else:
-            traits_list.append(str(item))
-
-    signature_style = []
-    for item in persona_cfg.get('signature_style', []):
-        if isinstance(item, str):
-            signature_style.append(item)
-        elif isinstance(item, dict):
-            for k, v in item.items():
-                signature_style.append(f"{k}: {v}")
-
-    # Adaptive tone profiles (new schema)
-    tone_profiles = persona_cfg.get('adaptive_tone_profiles') or config.get('adaptive_tone') or {}
-
-    sentiment = detect_sentiment(user_input)
-    tone_profile = tone_profiles.get(sentiment, tone_profiles.get('default', {}))
-
-    tone_desc = []
-    if isinstance(tone_profile, dict):
-        for k, v in tone_profile.items():
-            tone_desc.append(f"{k}: {v}")
-    elif isinstance(tone_profile, list):
-        tone_desc.extend([str(x) for x in tone_profile])
-
-    # Conversational rules and safety: normalize to strings
-    rules_raw = persona_cfg.get('conversational_rules', [])
-    rules_list: List[str] = []
-    for item in rules_raw:
+def _kv_strings(items) -> List[str]:
+    """Normalize a YAML list of strings / {key: value} maps into strings."""
+    out: List[str] = []
+    for item in items or []:
         if isinstance(item, dict):
             for k, v in item.items():
-                rules_list.append(f"{k}: {v}")
+                out.append(f"{k}: {v}")
         else:
-            rules_list.append(str(item))
-
-    safety_raw = persona_cfg.get('safety', [])
-    safety_list: List[str] = []
-    for item in safety_raw:
-        if isinstance(item, dict):
-            for k, v in item.items():
-                safety_list.append(f"{k}: {v}")
+            out.append(str(item))
+    return out
+
+
+class PersonaEngine:
+    """Persona config compiled into prompt fragments.
+
+    The static prefix (identity, traits, style, rules, safety) and one tone line
+    per sentiment are rendered once, so building a prompt is a dict lookup plus
+    string concatenation.
+    """
+
+    def __init__(self, config: Dict):
+        self.config = config
+        # Support both old and new schema gracefully
+        persona_cfg = config.get('persona', {})
+        name = persona_cfg.get('name', 'FRIDAY')
+        respect_title = persona_cfg.get('respect_title') or persona_cfg.get('core', {}).get('primary_address', 'Exynos Thinkers')
+
+        # Traits/signature (new schema encodes weights; render names only)
+        traits_list = []
+        for item in persona_cfg.get('traits', []):
+            if isinstance(item, dict):
+                traits_list.extend(item.keys())
+            else:
+                traits_list.append(str(item))
+        signature_style = _kv_strings(persona_cfg.get('signature_style', []))
+        rules_list = _kv_strings(persona_cfg.get('conversational_rules', []))
+        safety_list = _kv_strings(persona_cfg.get('safety', []))
+
+        self.prefix = (
+            f"You are {name} — a motivational, technically-capable assistant.\n"
+            f"Always address the team as \"{respect_title}\".\n\n"
+            f"Core traits: {', '.join(traits_list) if traits_list else 'motivational, supportive, direct'}.\n"
+            f"Signature style: {', '.join(signature_style) if signature_style else 'end with a motivational nudge; occasional light joke'}.\n\n"
+            f"Conversational rules: {', '.join(rules_list)}\n"
+            f"Safety: {', '.join(safety_list)}\n\n"
+        )
+
+        # Adaptive tone profiles (new schema)
+        tone_profiles = persona_cfg.get('adaptive_tone_profiles') or config.get('adaptive_tone') or {}
+        self.tone_lines: Dict[str, str] = {}
+        for mood in set(tone_profiles) | set(SENTIMENT_PRIORITY) | {'default'}:
+            profile = tone_profiles.get(mood, tone_profiles.get('default', {}))
+            if isinstance(profile, dict):
+                tone_desc = [f"{k}: {v}" for k, v in profile.items()]
+            elif isinstance(profile, list):
+                tone_desc = [str(x) for x in profile]
+            else:
+                tone_desc = []
+            self.tone_lines[mood] = f"Adaptive tone now: {', '.join(tone_desc) if tone_desc else 'encouraging, high directness, light humor'}.\n"
+
+        self.depth_hint = "\nRespond using structured sections.\n" + _format_depth_sections()
+
+    def prompt(self, user_input: str, sentiment: Optional[str] = None) -> str:
+        return self.prefix + self.turn_instructions(user_input, sentiment)
+
+    def system_prompt(self) -> str:
+        """Static part of the persona; byte-identical across turns (chat system message)."""
+        return self.prefix
+
+    def turn_instructions(self, user_input: str, sentiment: Optional[str] = None) -> str:
+        """Per-turn part: tone for the detected sentiment, plus the depth template if asked."""
+        sentiment = sentiment or detect_sentiment(user_input)
+        text = self.tone_lines.get(sentiment, self.tone_lines['default'])
+        # If user asks for depth, include sectioned template hint
+        if _DEPTH_RE.search(user_input):
+            text += self.depth_hint
+        return text
+
+
+# path -> (mtime_ns, size, sha1, PersonaEngine)
+_ENGINE_CACHE: Dict[Path, tuple] = {}
+_ENGINE_LOCK = threading.Lock()
+
+
+def get_persona_engine(root_path: Optional[Path] = None) -> PersonaEngine:
+    """Compiled persona for persona_config.yaml; re-parsed only when the file's
+    mtime/size change and its content hash differs."""
+    path = _persona_config_path(root_path)
+    try:
+        st = path.stat()
+        stamp = (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        stamp = None
+    with _ENGINE_LOCK:
+        cached = _ENGINE_CACHE.get(path)
+        if cached and cached[:2] == (stamp or (None, None)):
+            return cached[3]
+        if stamp is None:
+            engine = PersonaEngine(get_default_config())
+            _ENGINE_CACHE[path] = (None, None, None, engine)
+            return engine
+        raw = path.read_bytes()
+        digest = hashlib.sha1(raw).hexdigest()
+        if cached and cached[2] == digest:
+            engine = cached[3]
         else:
-            safety_list.append(str(item))
-
-    base_prompt = (
-        f"You are {name} — a motivational, technically-capable assistant.\n"
-        f"Always address the team as \"{respect_title}\".\n\n"
-        f"Core traits: {', '.join(traits_list) if traits_list else 'motivational, supportive, direct'}.\n"
-        f"Signature style: {', '.join(signature_style) if signature_style else 'end with a motivational nudge; occasional light joke'}.\n\n"
-        f"Conversational rules: {', '.join(rules_list)}\n"
-        f"Safety: {', '.join(safety_list)}\n\n"
-        f"Adaptive tone now: {', '.join(tone_desc) if tone_desc else 'encouraging, high directness, light humor'}.\n"
-    )
-
-    # If user asks for depth, include sectioned template hint
-    if re.search(r"(deep|details|explain|long|in\s*depth|comprehensive|more detail)", user_input, re.I):
-        base_prompt += "\nRespond using structured sections.\n" + _format_depth_sections()
-
-    return base_prompt
+            engine = PersonaEngine(yaml.safe_load(raw) or get_default_config())
+        _ENGINE_CACHE[path] = (stamp[0], stamp[1], digest, engine)
+        return engine
+
+
+@timed("generate_adaptive_prompt")
+def generate_adaptive_prompt(user_input: str, config: Dict = None, sentiment: Optional[str] = None) -> str:
+    """Generate adaptive persona prompt based on friday_v2 schema with tone and depth.
+    Pass `sentiment` if it was already detected for this input; without `config`
+    the cached engine for persona_config.yaml is used."""
+    engine = get_persona_engine() if config is None else PersonaEngine(config)
+    return engine.prompt(user_input, sentiment)
 
 
 SYSTEM_PROMPT = """
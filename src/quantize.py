@@ -0,0 +1,62 @@
+from typing import Tuple
+
+import numpy as np
+
+# Storage formats for embeddings: bytes per 384-d MiniLM vector
+#   float32 1536 · float16 768 · int8 384 (+4 for the scale) · binary 48
+DTYPES = ("float32", "float16", "int8")
+
+# Set bits per byte value, for NumPy < 2 (no np.bitwise_count)
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def quantize(vecs, dtype: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Encode rows of `vecs` as (codes, scales).
+
+    int8 is symmetric per-vector: code = round(v / scale), scale = max|v| / 127.
+    float16/float32 need no scale (scales are all 1).
+    """
+    vecs = np.atleast_2d(np.asarray(vecs, dtype=np.float32))
+    ones = np.ones(len(vecs), dtype=np.float32)
+    if dtype == "float32":
+        return vecs, ones
+    if dtype == "float16":
+        return vecs.astype(np.float16), ones
+    if dtype == "int8":
+        scales = np.abs(vecs).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vecs / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    raise ValueError(f"Unknown embedding dtype: {dtype}")
+
+
+def dequantize(codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    out = codes.astype(np.float32)
+    if codes.dtype == np.int8:
+        out *= np.asarray(scales, dtype=np.float32).reshape(-1, 1) if out.ndim == 2 else scales
+    return out
+
+
+def approx_dots(codes: np.ndarray, scales: np.ndarray, q: np.ndarray, chunk: int = 8192) -> np.ndarray:
+    """Dot products of quantized rows with float32 queries `q` (queries x dim),
+    decoded in chunks so the float32 copy never exceeds `chunk` rows."""
+    q = np.atleast_2d(np.asarray(q, dtype=np.float32))
+    out = np.empty((len(q), len(codes)), dtype=np.float32)
+    for start in range(0, len(codes), chunk):
+        block = codes[start:start + chunk].astype(np.float32)
+        out[:, start:start + chunk] = q @ block.T
+    if codes.dtype == np.int8:
+        out *= scales
+    return out
+
+
+def sign_bits(vecs) -> np.ndarray:
+    """1 bit per dimension (v > 0), packed: 384 dims -> 48 bytes."""
+    return np.packbits(np.atleast_2d(np.asarray(vecs)) > 0, axis=1)
+
+
+def hamming(bits: np.ndarray, qbits: np.ndarray) -> np.ndarray:
+    """Hamming distance of every packed row in `bits` to the packed query `qbits`."""
+    xor = np.bitwise_xor(bits, qbits.reshape(1, -1))
+    counts = np.bitwise_count(xor) if hasattr(np, "bitwise_count") else _POPCOUNT[xor]
+    return counts.sum(axis=1, dtype=np.int32)
@@ -0,0 +1,136 @@
+import math
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+# Default weights for the hybrid ranker (overridable from memory_config.yaml)
+DEFAULT_WEIGHTS = {
+    "similarity": 1.0,
+    "recency": 0.35,
+    "pinned": 0.25,
+    "summary": 0.1,
+    "brevity": 0.1,
+}
+
+# Registered ranking strategies: name -> fn(query_vec, candidates, top_k, cfg)
+_RANKERS: Dict[str, Callable] = {}
+
+
+def register_ranker(name: str):
+    """Register a ranking strategy under `name` (usable as ranking.strategy)."""
+    def deco(fn):
+        _RANKERS[name] = fn
+        return fn
+    return deco
+
+
+def get_ranker(name: str) -> Callable:
+    return _RANKERS.get(name, _RANKERS["hybrid"])
+
+
+def _unit(v) -> Optional[np.ndarray]:
+    if v is None:
+        return None
+    a = np.asarray(v, dtype=np.float32)
+    n = float(np.linalg.norm(a))
+    return a / n if n > 0 else a
+
+
+def cosine_similarity(query_vec, cand: dict) -> float:
+    """Cosine between query and candidate; falls back to Chroma's L2 distance
+    (MiniLM vectors are unit-norm, so cos = 1 - d²/2)."""
+    q = _unit(query_vec)
+    e = _unit(cand.get("embedding"))
+    if q is not None and e is not None and q.shape == e.shape:
+        return float(np.dot(q, e))
+    d = cand.get("distance")
+    if d is None:
+        return 0.0
+    return 1.0 - float(d) / 2.0
+
+
+def recency_decay(ts: float, now: float, half_life_hours: float) -> float:
+    age_h = max(0.0, now - ts) / 3600.0
+    return math.exp(-math.log(2) * age_h / max(half_life_hours, 1e-6))
+
+
+def brevity_score(text: str) -> float:
+    return 1.0 / (1 + max(0, len(text) - 160) / 160)
+
+
+def hybrid_scores(query_vec, candidates: List[dict], cfg: dict, now: Optional[float] = None) -> List[float]:
+    """Weighted sum of similarity, recency decay, pin boost, summary boost and brevity."""
+    w = DEFAULT_WEIGHTS | (cfg.get("weights") or {})
+    half_life = float(cfg.get("recency_half_life_hours", 72))
+    now = now or time.time()
+    scores = []
+    for c in candidates:
+        meta = c.get("metadata") or {}
+        sim = cosine_similarity(query_vec, c)
+        c["similarity"] = sim
+        score = (
+            w["similarity"] * sim
+            + w["recency"] * recency_decay(meta.get("ts", now), now, half_life)
+            + w["pinned"] * (1.0 if meta.get("pinned") else 0.0)
+            + w["summary"] * (1.0 if meta.get("type") == "summary" else 0.0)
+            + w["brevity"] * brevity_score(c.get("document") or "")
+        )
+        scores.append(score)
+    return scores
+
+
+def mmr_select(candidates: List[dict], scores: List[float], k: int, lambda_: float = 0.7) -> List[int]:
+    """Maximal Marginal Relevance: pick k indices trading relevance against
+    similarity to what is already selected, so slots aren't spent on near-duplicates."""
+    if not candidates or k <= 0:
+        return []
+    order = sorted(range(len(candidates)), key=lambda i: scores[i], reverse=True)
+    vecs = [_unit(c.get("embedding")) for c in candidates]
+    if any(v is None for v in vecs) or lambda_ >= 1.0:
+        return order[:k]
+
+    # Normalise relevance into [0, 1] so it is comparable with cosine
+    lo, hi = min(scores), max(scores)
+    rel = [(s - lo) / (hi - lo) if hi > lo else 1.0 for s in scores]
+    mat = np.vstack(vecs)
+    sims = mat @ mat.T
+
+    selected = [order[0]]
+    remaining = order[1:]
+    while remaining and len(selected) < k:
+        best, best_val = None, -math.inf
+        for i in remaining:
+            redundancy = max(float(sims[i, j]) for j in selected)
+            val = lambda_ * rel[i] - (1 - lambda_) * redundancy
+            if val > best_val:
+                best, best_val = i, val
+        selected.append(best)
+        remaining.remove(best)
+    return selected
+
+
+@register_ranker("hybrid")
+def hybrid_rank(query_vec, candidates: List[dict], top_k: int, cfg: dict) -> List[dict]:
+    scores = hybrid_scores(query_vec, candidates, cfg)
+    for c, s in zip(candidates, scores):
+        c["score"] = s
+    picked = mmr_select(candidates, scores, top_k, float(cfg.get("mmr_lambda", 0.7)))
+    return [candidates[i] for i in picked]
+
+
+@register_ranker("recency")
+def recency_rank(query_vec, candidates: List[dict], top_k: int, cfg: dict) -> List[dict]:
+    """Legacy scoring: recency + brevity only (ignores vector distance)."""
+    now = time.time()
+    for c in candidates:
+        meta = c.get("metadata") or {}
+        age_sec = max(1.0, now - meta.get("ts", now))
+        c["score"] = 1.0 / (1.0 + age_sec / 86400.0) + 0.3 * brevity_score(c.get("document") or "")
+    return sorted(candidates, key=lambda c: c["score"], reverse=True)[:top_k]
+
+
+def rank(query_vec, candidates: List[dict], top_k: int, cfg: Optional[dict] = None) -> List[dict]:
+    """Run the configured ranking strategy over store candidates."""
+    cfg = cfg or {}
+    return get_ranker(cfg.get("strategy", "hybrid"))(query_vec, candidates, top_k, cfg)
@@ -0,0 +1,277 @@
+"""Benchmark the memory subsystem against a throwaway store and a fake LLM.
+
+Seeds a temporary Chroma store with N synthetic memories per size, points
+llm_utils at a local stub of the Ollama HTTP API, and times save_message,
+retrieve_memory, get_pinned_messages (store query, and its per-namespace cache
+as get_pinned_cached), forget_by_text and summarize_and_compact.
+Reports p50/p95/p99 latency, throughput and RSS per operation as JSON, for each
+storage backend given (chroma, numpy), plus recall@10 of the store's vector
+search against exact brute force (approximate indexes, quantization).
+
+Usage:
+	python src/scripts/bench_memory.py --sizes 1000,10000 --out bench.json
+	python src/scripts/bench_memory.py --backend chroma,numpy --sizes 10000
+	python src/scripts/bench_memory.py --backend numpy --quantization int8 --binary
+	python src/scripts/bench_memory.py --baseline bench.json --threshold 1.25
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+WORDS = (
+	"deadline project goal remember prefer coffee tea python rust meeting report friday monday "
+	"budget design review launch bug fix memory model vector search team plan task decision "
+	"travel gym music book idea note reminder schedule client demo release roadmap"
+).split()
+
+SEED_BATCH = 5000
+DIM = 384
+RECALL_TOLERANCE = 0.02
+
+
+class FakeOllama(BaseHTTPRequestHandler):
+	"""Answers /api/generate and /api/chat like Ollama, without a model."""
+	protocol_version = "HTTP/1.1"
+
+	def log_message(self, *args):
+		pass
+
+	def do_POST(self):
+		body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+		if body.get("format"):
+			text = json.dumps({"bullets": ["user prefers concise answers", "project deadline is friday"], "tags": ["work", "prefs"]})
+		else:
+			text = "Noted. Keep going, you are doing great!"
+		chat = self.path.endswith("/api/chat")
+		done = {"done": True, "eval_count": 12, "eval_duration": 1_000_000, "prompt_eval_count": 40, "prompt_eval_duration": 500_000}
+		if body.get("stream", True):
+			self.send_response(200)
+			self.send_header("Content-Type", "application/x-ndjson")
+			self.send_header("Transfer-Encoding", "chunked")
+			self.end_headers()
+			for word in text.split(" "):
+				piece = word + " "
+				self._chunk({"message": {"role": "assistant", "content": piece}, "done": False} if chat else {"response": piece, "done": False})
+			self._chunk(done)
+			self.wfile.write(b"0\r\n\r\n")
+		else:
+			reply = ({"message": {"role": "assistant", "content": text}} if chat else {"response": text}) | done
+			data = json.dumps(reply).encode()
+			self.send_response(200)
+			self.send_header("Content-Type", "application/json")
+			self.send_header("Content-Length", str(len(data)))
+			self.end_headers()
+			self.wfile.write(data)
+
+	def _chunk(self, obj):
+		data = (json.dumps(obj) + "\n").encode()
+		self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+
+def start_fake_ollama():
+	server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOllama)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server
+
+
+def rss_mb() -> float:
+	"""Current resident set size (Linux), else peak RSS."""
+	try:
+		with open("/proc/self/statm") as f:
+			return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+	except (OSError, ValueError):
+		pass
+	try:
+		import resource
+		peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+	except ImportError:
+		return 0.0
+
+
+def sentence(rng: random.Random, n: int = 10) -> str:
+	return "I " + " ".join(rng.choice(WORDS) for _ in range(n)) + "."
+
+
+def seed(memory, n: int, rng: random.Random, pin_ratio: float = 0.01):
+	"""Insert n synthetic memories directly (random unit vectors, spread over 90 days)."""
+	np_rng = np.random.default_rng(rng.randint(0, 2**31))
+	col = memory.get_collection()
+	now = time.time()
+	for start in range(0, n, SEED_BATCH):
+		size = min(SEED_BATCH, n - start)
+		vecs = np_rng.standard_normal((size, DIM)).astype(np.float32)
+		vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+		metas = []
+		for i in range(size):
+			meta = {"role": "user" if i % 2 else "assistant", "ts": now - rng.uniform(0, 90 * 86400)}
+			if rng.random() < pin_ratio:
+				meta.update(pinned=True, pin_note="bench")
+			metas.append(meta)
+		col.add(
+			ids=[f"seed_{start + i}" for i in range(size)],
+			documents=[sentence(rng) for _ in range(size)],
+			metadatas=metas,
+			embeddings=vecs.tolist(),
+		)
+
+
+def measure(name: str, fn, iterations: int) -> dict:
+	lat = []
+	start = time.perf_counter()
+	for i in range(iterations):
+		t = time.perf_counter()
+		fn(i)
+		lat.append((time.perf_counter() - t) * 1000.0)
+	wall = time.perf_counter() - start
+	p50, p95, p99 = np.percentile(lat, [50, 95, 99]).tolist()
+	result = {
+		"iterations": iterations,
+		"p50_ms": p50,
+		"p95_ms": p95,
+		"p99_ms": p99,
+		"mean_ms": float(np.mean(lat)),
+		"throughput_ops": iterations / wall if wall > 0 else 0.0,
+		"rss_mb": rss_mb(),
+	}
+	print(f"  {name:<22} p50 {p50:8.2f} ms  p95 {p95:8.2f} ms  p99 {p99:8.2f} ms  {result['throughput_ops']:8.1f} op/s  rss {result['rss_mb']:.0f} MB")
+	return result
+
+
+def measure_recall(memory, rng: random.Random, k: int = 10, queries: int = 50) -> dict:
+	"""recall@k of collection.query against exact search over the stored vectors."""
+	col = memory.get_collection()
+	res = col.get(include=["embeddings"])
+	ids = np.array(res["ids"])
+	vecs = np.asarray(res["embeddings"], dtype=np.float32)
+	np_rng = np.random.default_rng(rng.randint(0, 2**31))
+	picks = vecs[np_rng.integers(0, len(vecs), queries)]
+	q = picks + 0.05 * np_rng.standard_normal(picks.shape).astype(np.float32)
+	q /= np.linalg.norm(q, axis=1, keepdims=True)
+	exact = np.argsort(-(q @ vecs.T), axis=1)[:, :k]
+	found = col.query(query_embeddings=q.tolist(), n_results=k, include=[])["ids"]
+	recall = float(np.mean([len(set(f) & set(ids[e])) / k for f, e in zip(found, exact)]))
+	print(f"  {'recall@' + str(k):<22} {recall:.3f}")
+	return {"k": k, "queries": queries, "recall": recall}
+
+
+def open_store(memory, path: Path, backend: str = "chroma"):
+	"""Point memory.py at a fresh `backend` store under `path`."""
+	memory.MEMORY_CONFIG["backend"] = backend
+	memory.MEMORY_CONFIG["chroma_path"] = str(path)
+	memory.MEMORY_CONFIG["numpy_path"] = str(path)
+	memory._client = None
+	memory._COLLECTIONS.clear()
+	memory._invalidate_pinned_count()
+
+
+def bench_size(memory, n: int, args, rng: random.Random, backend: str = "chroma") -> dict:
+	workdir = Path(tempfile.mkdtemp(prefix=f"friday_bench_{n}_"))
+	try:
+		open_store(memory, workdir / "store", backend)
+		t = time.perf_counter()
+		seed(memory, n, rng)
+		print(f"[{backend} {n}] seeded in {time.perf_counter() - t:.1f}s")
+		memory.warmup_memory(background=False)
+		it = args.iterations
+		results = {
+			"save_message": measure("save_message", lambda i: memory.save_message("user", f"Remember {sentence(rng)} #{i}"), it),
+			"retrieve_memory": measure("retrieve_memory", lambda i: memory.retrieve_memory(f"{sentence(rng, 6)} {i}", top_k=3), it),
+			# Uncached: the per-namespace pinned cache is dropped so the store query is timed
+			"get_pinned_messages": measure("get_pinned_messages", lambda i: (memory._invalidate_pinned_count(), memory.get_pinned_messages()), it),
+			"get_pinned_cached": measure("get_pinned_cached", lambda i: memory.get_pinned_messages(), it),
+			"forget_by_text": measure("forget_by_text", lambda i: memory.forget_by_text(sentence(rng, 6), top_k=1), max(1, it // 5)),
+			"recall": measure_recall(memory, rng),
+			"summarize_and_compact": measure("summarize_and_compact", lambda i: memory.summarize_and_compact(limit=memory.MEMORY_CONFIG["compaction"]["chunk_size"]), args.compact_iterations),
+		}
+		return results
+	finally:
+		open_store(memory, workdir / "unused", backend)
+		shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+	"""Operations whose p95 grew by more than `threshold`x against the baseline,
+	and recall that dropped by more than RECALL_TOLERANCE."""
+	regressions = []
+	for size, ops in current["results"].items():
+		for op, stats in ops.items():
+			base = baseline.get("results", {}).get(size, {}).get(op)
+			if base and "recall" in stats:
+				if base["recall"] - stats["recall"] > RECALL_TOLERANCE:
+					regressions.append(f"{op} @ {size}: {base['recall']:.3f} -> {stats['recall']:.3f}")
+			elif base and base["p95_ms"] > 0 and stats["p95_ms"] / base["p95_ms"] > threshold:
+				regressions.append(f"{op} @ {size}: p95 {base['p95_ms']:.2f} -> {stats['p95_ms']:.2f} ms")
+	return regressions
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description="FRIDAY memory benchmark")
+	parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated store sizes")
+	parser.add_argument("--backend", default="chroma", help="comma-separated storage backends: chroma, numpy")
+	parser.add_argument("--quantization", default="none", choices=["none", "float16", "int8"], help="numpy backend search index")
+	parser.add_argument("--binary", action="store_true", help="numpy backend: sign-bit Hamming prefilter")
+	parser.add_argument("--iterations", type=int, default=50)
+	parser.add_argument("--compact-iterations", type=int, default=3)
+	parser.add_argument("--seed", type=int, default=7)
+	parser.add_argument("--out", type=Path, default=Path("bench_memory.json"))
+	parser.add_argument("--baseline", type=Path, help="previous results JSON to compare against")
+	parser.add_argument("--threshold", type=float, default=1.25, help="max allowed p95 ratio vs baseline")
+	args = parser.parse_args()
+
+	import llm_utils
+	import memory
+	import metrics
+
+	metrics.METRICS_PATH = None
+	memory.MEMORY_CONFIG["numpy_index"].update(quantization=args.quantization, binary_prefilter=args.binary)
+	server = start_fake_ollama()
+	llm_utils.OLLAMA_URL = f"http://127.0.0.1:{server.server_port}/api/generate"
+	llm_utils.OLLAMA_CHAT_URL = f"http://127.0.0.1:{server.server_port}/api/chat"
+
+	report = {
+		"meta": {
+			"ts": time.time(),
+			"python": platform.python_version(),
+			"platform": platform.platform(),
+			"iterations": args.iterations,
+			"numpy_index": dict(memory.MEMORY_CONFIG["numpy_index"]),
+		},
+		"results": {},
+	}
+	backends = [b.strip() for b in args.backend.split(",") if b.strip()]
+	for backend in backends:
+		for n in (int(s) for s in args.sizes.split(",") if s.strip()):
+			# Single-backend runs keep the plain size key so older baselines still compare
+			key = str(n) if len(backends) == 1 and backend == "chroma" else f"{backend}:{n}"
+			report["results"][key] = bench_size(memory, n, args, random.Random(args.seed + n), backend)
+	server.shutdown()
+
+	with open(args.out, "w") as f:
+		json.dump(report, f, indent=2)
+	print(f"Wrote {args.out}")
+
+	if args.baseline:
+		with open(args.baseline) as f:
+			regressions = compare(report, json.load(f), args.threshold)
+		if regressions:
+			print("Regressions:\n  " + "\n  ".join(regressions))
+			sys.exit(1)
+		print("No regressions against baseline.")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,63 @@
+"""Bulk-import historical transcripts (JSONL) into FRIDAY memory.
+
+Each line is either a single message {"role": ..., "content": ..., "ts": ...}
+or a transcript {"messages": [{...}, ...]}. Messages are embedded and written
+in batches through memory.save_messages.
+
+Usage: python src/scripts/import_transcripts.py history.jsonl [--batch-size 256] [--all] [--user NAME]
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def iter_messages(path: Path):
+	with open(path, "r", encoding="utf-8") as f:
+		for lineno, line in enumerate(f, 1):
+			line = line.strip()
+			if not line:
+				continue
+			try:
+				obj = json.loads(line)
+			except json.JSONDecodeError as exc:
+				print(f"skip line {lineno}: {exc}")
+				continue
+			for msg in obj.get("messages", [obj]):
+				if msg.get("role") in ("user", "assistant") and msg.get("content"):
+					yield msg
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("path", type=Path)
+	parser.add_argument("--batch-size", type=int, default=256)
+	parser.add_argument("--all", action="store_true", help="store every message, skipping the usefulness filter")
+	parser.add_argument("--user", default="", help="memory namespace to import into (matches ?user= in the app)")
+	args = parser.parse_args()
+
+	from memory import save_messages, set_namespace
+
+	set_namespace(args.user)
+
+	start = time.time()
+	seen = stored = 0
+	batch = []
+	for msg in iter_messages(args.path):
+		batch.append(msg)
+		seen += 1
+		if len(batch) >= args.batch_size:
+			stored += save_messages(batch, filter_useful=not args.all, cache=False)
+			batch = []
+	if batch:
+		stored += save_messages(batch, filter_useful=not args.all, cache=False)
+
+	elapsed = max(time.time() - start, 1e-9)
+	print(f"Read {seen} messages, stored {stored} in {elapsed:.1f}s ({seen / elapsed:.0f} msg/s)")
+
+
+if __name__ == "__main__":
+	main()
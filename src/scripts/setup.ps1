@@ -1,5 +1,6 @@
 Param(
-    [switch]$PullModel
+    [switch]$PullModel,
+    [switch]$RegisterPersona
 )
 
 $ErrorActionPreference = "Stop"
@@ -101,6 +102,17 @@ if ($ollamaExists -and $PullModel) {
     }
 }
 
+if ($ollamaExists -and $RegisterPersona) {
+    # Bake the persona into a local model so its system prompt is fixed (and prefix-cached) by Ollama.
+    # Then set PERSONA_MODEL = "friday" in src/llm_utils.py.
+    Write-Section "Registering FRIDAY persona from src\config\Modelfile"
+    try {
+        ollama create friday -f src\config\Modelfile
+    } catch {
+        Write-Warning "Failed to create the friday model. You can try manually: ollama create friday -f src\config\Modelfile"
+    }
+}
+
 Write-Section "All Set"
 Write-Host "Next steps:" -ForegroundColor Green
 Write-Host "1) To open Streamlit demo:    streamlit hello"
@@ -0,0 +1,99 @@
+import re
+from collections import deque
+from typing import Deque, Dict, List
+
+DEFAULT_WINDOW = 20          # messages (10 exchanges, persona_config short_term_window)
+MAX_TURN_CHARS = 600         # compact form: longer turns are clipped
+MAX_SUMMARY_CHARS = 800      # rolling summary of evicted turns
+
+_WS_RE = re.compile(r"\s+")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s")
+_FOLLOW_UP_RE = re.compile(
+    r"^(and|but|so|also|then|why|how come|what about|how about|ok|okay|yes|no|sure|"
+    r"it|that|this|those|these|they|he|she|more|again|continue|go on)\b"
+    r"|\b(it|that|this|those|these|them)\b[?.!]*$",
+    re.I,
+)
+_WORD_RE = re.compile(r"[a-z0-9']+")
+# Function words that carry no topic of their own
+_STOPWORDS = frozenset("""
+a about again all also am an and any are as at be because been but by can could
+did do does doing done else for from go going got had has have he her him his how
+i if in into is it its just like me mean meant more most my no not now of ok okay
+on one ones or other our please really say said she should so some such sure tell
+than that the their them then there these they thing things this those to too up
+us was we well were what when where which who why will with would yes you your
+continue first second third last next previous same
+""".split())
+
+
+def compact(text: str, limit: int = MAX_TURN_CHARS) -> str:
+    """Collapse whitespace and clip to `limit` characters."""
+    text = _WS_RE.sub(" ", text).strip()
+    return text if len(text) <= limit else text[:limit].rstrip() + "…"
+
+
+def first_sentence(text: str) -> str:
+    return _SENTENCE_RE.split(text, maxsplit=1)[0]
+
+
+def content_words(text: str) -> set:
+    return {w for w in _WORD_RE.findall(text.lower()) if len(w) > 2 and w not in _STOPWORDS}
+
+
+def is_follow_up(text: str, window_text: str = "", max_words: int = 8) -> bool:
+    """Short anaphoric messages that lean on the previous turn ("why?", "and the
+    second one?"). Any content word must already appear in `window_text` (the
+    recent turns); otherwise the question brings a new topic and needs retrieval."""
+    words = text.split()
+    if not 0 < len(words) <= max_words or not _FOLLOW_UP_RE.search(text.strip()):
+        return False
+    return content_words(text) <= content_words(window_text)
+
+
+class ShortTermMemory:
+    """Ring buffer of the most recent chat turns for one session.
+
+    Turns are stored compacted; when the window is full the oldest turn is
+    evicted and its first sentence is folded into a rolling extractive
+    summary, which is itself capped by dropping its oldest sentences.
+    """
+
+    def __init__(self, window: int = DEFAULT_WINDOW):
+        self.window = max(2, int(window))
+        self.turns: Deque[Dict[str, str]] = deque()
+        self.summary = ""
+
+    def resize(self, window: int):
+        self.window = max(2, int(window))
+        while len(self.turns) > self.window:
+            self._evict()
+
+    def add(self, role: str, content: str):
+        if role not in ("user", "assistant") or not content.strip():
+            return
+        self.turns.append({"role": role, "content": compact(content)})
+        while len(self.turns) > self.window:
+            self._evict()
+
+    def _evict(self):
+        turn = self.turns.popleft()
+        gist = first_sentence(turn["content"])
+        label = "User" if turn["role"] == "user" else "FRIDAY"
+        summary = f"{self.summary} {label}: {gist}".strip()
+        while len(summary) > MAX_SUMMARY_CHARS and " " in summary:
+            # Drop the oldest sentence (or clause) first
+            parts = _SENTENCE_RE.split(summary, maxsplit=1)
+            summary = parts[1] if len(parts) > 1 else summary[-MAX_SUMMARY_CHARS:]
+        self.summary = summary
+
+    def messages(self) -> List[Dict[str, str]]:
+        """Recent turns as chat messages, oldest first."""
+        return [dict(t) for t in self.turns]
+
+    def clear(self):
+        self.turns.clear()
+        self.summary = ""
+
+    def __len__(self) -> int:
+        return len(self.turns)
@@ -0,0 +1,61 @@
+import time
+from typing import Dict, List
+
+# Repaint budget: flush after this many seconds or this many tokens, whichever first
+FLUSH_INTERVAL = 0.05
+FLUSH_TOKENS = 32
+
+
+class StreamRenderer:
+    """Coalesces streamed tokens and repaints a Streamlit placeholder on a
+    time/size budget instead of once per token.
+
+    Tokens are appended to a pending list; on flush only the pending part is
+    joined onto the accumulated text, so total string work stays linear.
+    """
+
+    def __init__(self, placeholder, interval: float = FLUSH_INTERVAL,
+                 max_tokens: int = FLUSH_TOKENS, cursor: str = "▌"):
+        self.placeholder = placeholder
+        self.interval = interval
+        self.max_tokens = max_tokens
+        self.cursor = cursor
+        self._text = ""
+        self._pending: List[str] = []
+        self._started = time.perf_counter()
+        self._last_flush = self._started
+        self.tokens = 0
+        self.flushes = 0
+
+    @property
+    def text(self) -> str:
+        return self._text + "".join(self._pending)
+
+    def push(self, token: str):
+        self._pending.append(token)
+        self.tokens += 1
+        now = time.perf_counter()
+        if len(self._pending) >= self.max_tokens or now - self._last_flush >= self.interval:
+            self.flush(now)
+
+    def flush(self, now: float | None = None, final: bool = False):
+        if self._pending:
+            self._text += "".join(self._pending)
+            self._pending.clear()
+        self.placeholder.markdown(self._text if final else self._text + self.cursor)
+        self.flushes += 1
+        self._last_flush = now or time.perf_counter()
+
+    def close(self) -> str:
+        """Final repaint without the cursor; returns the full reply."""
+        self.flush(final=True)
+        return self._text
+
+    def stats(self) -> Dict:
+        elapsed = max(self._last_flush - self._started, 1e-9)
+        return {
+            "tokens": self.tokens,
+            "flushes": self.flushes,
+            "flush_rate": self.flushes / elapsed,
+            "chars": len(self._text),
+        }
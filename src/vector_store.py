@@ -0,0 +1,393 @@
+import json
+import shutil
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from quantize import approx_dots, hamming, quantize, sign_bits
+
+# Metadata keys kept as parallel column arrays so `where` filters are vector masks;
+# any other key is still filterable, just by a Python scan of the metadata dicts
+FLOAT_COLUMNS = ("ts",)
+BOOL_COLUMNS = ("pinned",)
+OBJECT_COLUMNS = ("role", "type", "norm_hash")
+
+INITIAL_CAPACITY = 1024
+# Binary prefilter keeps this many candidates per requested result (before the
+# quantized pass), and never fewer than MIN_PREFILTER
+PREFILTER_FACTOR = 100
+MIN_PREFILTER = 1000
+
+
+class NumpyCollection:
+    """In-process vector collection implementing the subset of the Chroma
+    collection API that memory.py uses (add/upsert/update/get/query/delete/count).
+
+    Embeddings live in one contiguous float32 matrix memory-mapped from
+    `vectors.f32`; documents and metadata are persisted in SQLite and mirrored in
+    memory as parallel arrays indexed by slot. A query is a single matrix product
+    over the used slots followed by argpartition; `where` filters are boolean
+    masks over the column arrays. Deleted slots are reused.
+    Meant for a single process (the Streamlit server and its worker threads).
+
+    With `quantization` (float16 or int8) the search runs on an in-RAM quantized
+    copy of the matrix and only the top `rerank_factor` x n_results candidates are
+    rescored from the float32 file; `binary` adds a sign-bit Hamming prefilter
+    in front of that for very large stores.
+    """
+
+    def __init__(self, path: Path, name: str, quantization: str = "none", binary: bool = False,
+                 rerank_factor: int = 4):
+        self.name = name
+        self.quantization = None if quantization in (None, "none", "float32") else quantization
+        self.binary = bool(binary)
+        self.rerank_factor = max(1, int(rerank_factor))
+        self._codes: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._bits: Optional[np.ndarray] = None
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(str(self.path / "records.sqlite"), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS records (slot INTEGER PRIMARY KEY, id TEXT UNIQUE, document TEXT, metadata TEXT)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+        self.dim: Optional[int] = None
+        self.capacity = 0
+        self._vectors: Optional[np.memmap] = None
+        self._norms = np.zeros(0, dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._columns: Dict[str, np.ndarray] = {}
+        self._ids: List[Optional[str]] = []
+        self._docs: List[Optional[str]] = []
+        self._metas: List[Optional[Dict]] = []
+        self._index: Dict[str, int] = {}
+        self._free: List[int] = []
+        self._load()
+
+    # ---- storage -------------------------------------------------------------
+
+    def _load(self):
+        row = self._db.execute("SELECT value FROM meta WHERE name='dim'").fetchone()
+        if not row:
+            return
+        cap = self._db.execute("SELECT value FROM meta WHERE name='capacity'").fetchone()
+        self._open(int(row[0]), int(cap[0]))
+        for slot, rid, doc, meta in self._db.execute("SELECT slot, id, document, metadata FROM records"):
+            self._set_row(slot, rid, doc, json.loads(meta or "{}"))
+        self._norms[self._alive] = np.linalg.norm(self._vectors[:self.capacity][self._alive], axis=1)
+        self._free = sorted(np.flatnonzero(~self._alive).tolist(), reverse=True)
+        if self.quantization or self.binary:
+            for start in range(0, self.capacity, 8192):
+                stop = min(start + 8192, self.capacity)
+                self._encode(np.arange(start, stop), np.asarray(self._vectors[start:stop]))
+
+    def _open(self, dim: int, capacity: int):
+        vec_path = self.path / "vectors.f32"
+        if vec_path.exists() and vec_path.stat().st_size < capacity * dim * 4:
+            with open(vec_path, "r+b") as f:
+                f.truncate(capacity * dim * 4)
+        mode = "r+" if vec_path.exists() else "w+"
+        self._vectors = np.memmap(vec_path, dtype=np.float32, mode=mode, shape=(capacity, dim))
+        self.dim = dim
+        grow = capacity - self.capacity
+        self._norms = np.concatenate([self._norms, np.zeros(grow, dtype=np.float32)])
+        self._alive = np.concatenate([self._alive, np.zeros(grow, dtype=bool)])
+        if self.quantization:
+            dtype = np.int8 if self.quantization == "int8" else np.float16
+            codes = np.zeros((capacity, dim), dtype=dtype)
+            scales = np.ones(capacity, dtype=np.float32)
+            if self._codes is not None:
+                codes[:len(self._codes)] = self._codes
+                scales[:len(self._scales)] = self._scales
+            self._codes, self._scales = codes, scales
+        if self.binary:
+            bits = np.zeros((capacity, (dim + 7) // 8), dtype=np.uint8)
+            if self._bits is not None:
+                bits[:len(self._bits)] = self._bits
+            self._bits = bits
+        for key in FLOAT_COLUMNS:
+            self._columns[key] = np.concatenate([self._columns.get(key, np.zeros(0)), np.full(grow, np.nan)])
+        for key in BOOL_COLUMNS:
+            self._columns[key] = np.concatenate([self._columns.get(key, np.zeros(0, dtype=bool)), np.zeros(grow, dtype=bool)])
+        for key in OBJECT_COLUMNS:
+            self._columns[key] = np.concatenate([self._columns.get(key, np.empty(0, dtype=object)), np.full(grow, None, dtype=object)])
+        self._ids.extend([None] * grow)
+        self._docs.extend([None] * grow)
+        self._metas.extend([None] * grow)
+        self._free = list(range(capacity - 1, self.capacity - 1, -1)) + self._free
+        self.capacity = capacity
+
+    def _ensure_capacity(self, dim: int, extra: int):
+        if self.dim is None:
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('dim', ?)", (dim,))
+            self._open(dim, max(INITIAL_CAPACITY, extra))
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('capacity', ?)", (self.capacity,))
+        elif dim != self.dim:
+            raise ValueError(f"Embedding dimension {dim} does not match collection dimensionality {self.dim}")
+        if len(self._free) < extra:
+            new_cap = max(self.capacity * 2, self.capacity + extra - len(self._free))
+            self._vectors.flush()
+            self._vectors = None
+            self._open(self.dim, new_cap)
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('capacity', ?)", (self.capacity,))
+
+    def _encode(self, slots: np.ndarray, vecs: np.ndarray):
+        """Refresh the quantized / sign-bit copies of `slots`."""
+        if self.quantization:
+            self._codes[slots], self._scales[slots] = quantize(vecs, self.quantization)
+        if self.binary:
+            self._bits[slots] = sign_bits(vecs)
+
+    def _set_row(self, slot: int, rid: Optional[str], doc: Optional[str], meta: Optional[Dict]):
+        alive = rid is not None
+        self._ids[slot], self._docs[slot], self._metas[slot] = rid, doc, meta
+        self._alive[slot] = alive
+        meta = meta or {}
+        for key in FLOAT_COLUMNS:
+            self._columns[key][slot] = float(meta[key]) if key in meta else np.nan
+        for key in BOOL_COLUMNS:
+            self._columns[key][slot] = bool(meta.get(key, False))
+        for key in OBJECT_COLUMNS:
+            self._columns[key][slot] = meta.get(key)
+        if alive:
+            self._index[rid] = slot
+
+    # ---- filters -------------------------------------------------------------
+
+    def _mask(self, where: Optional[Dict]) -> np.ndarray:
+        mask = self._alive.copy()
+        if where:
+            mask &= self._where_mask(where)
+        return mask
+
+    def _where_mask(self, where: Dict) -> np.ndarray:
+        mask = np.ones(self.capacity, dtype=bool)
+        for key, cond in where.items():
+            if key == "$and":
+                for sub in cond:
+                    mask &= self._where_mask(sub)
+            elif key == "$or":
+                mask &= np.logical_or.reduce([self._where_mask(sub) for sub in cond])
+            else:
+                op, value = next(iter(cond.items())) if isinstance(cond, dict) else ("$eq", cond)
+                mask &= self._compare(key, op, value)
+        return mask
+
+    def _compare(self, key: str, op: str, value) -> np.ndarray:
+        if key in self._columns:
+            col = self._columns[key]
+        else:
+            missing = object()
+            col = np.array([(m or {}).get(key, missing) for m in self._metas], dtype=object)
+            col[col == missing] = None
+        if op == "$eq":
+            return col == value
+        if op == "$ne":
+            return col != value
+        if op in ("$in", "$nin"):
+            if col.dtype == object:
+                values = set(value)
+                hit = np.fromiter((x in values for x in col), dtype=bool, count=col.size)
+            else:
+                hit = np.isin(col, list(value))
+            return hit if op == "$in" else ~hit
+        if op in ("$gt", "$gte", "$lt", "$lte"):
+            if col.dtype == object:
+                col = np.array([np.nan if x is None else x for x in col], dtype=np.float64)
+            with np.errstate(invalid="ignore"):
+                return {"$gt": col > value, "$gte": col >= value, "$lt": col < value, "$lte": col <= value}[op]
+        raise ValueError(f"Unsupported where operator: {op}")
+
+    # ---- writes --------------------------------------------------------------
+
+    def add(self, ids: List[str], embeddings=None, documents=None, metadatas=None):
+        with self._lock:
+            dup = [i for i in ids if i in self._index]
+            if dup or len(set(ids)) != len(ids):
+                raise ValueError(f"Duplicate IDs: {dup or ids}")
+            self._write(ids, embeddings, documents, metadatas, merge=False)
+
+    def upsert(self, ids: List[str], embeddings=None, documents=None, metadatas=None):
+        with self._lock:
+            self._write(ids, embeddings, documents, metadatas, merge=True)
+
+    def update(self, ids: List[str], embeddings=None, documents=None, metadatas=None):
+        with self._lock:
+            known = [i for i, rid in enumerate(ids) if rid in self._index]
+            pick = lambda seq: None if seq is None else [seq[i] for i in known]
+            self._write([ids[i] for i in known], pick(embeddings), pick(documents), pick(metadatas), merge=True)
+
+    def _write(self, ids, embeddings, documents, metadatas, merge: bool):
+        if not ids:
+            return
+        vecs = None
+        if embeddings is not None:
+            vecs = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+            self._ensure_capacity(vecs.shape[1], len(ids))
+        elif self.dim is None:
+            raise ValueError("Embeddings are required for new records")
+        rows, slots = [], []
+        for n, rid in enumerate(ids):
+            slot = self._index.get(rid)
+            if slot is None:
+                if vecs is None:
+                    raise ValueError(f"Embeddings are required for new record {rid}")
+                slot = self._free.pop()
+                doc, meta = None, {}
+            else:
+                doc, meta = self._docs[slot], dict(self._metas[slot] or {})
+            if documents is not None:
+                doc = documents[n]
+            if metadatas is not None and metadatas[n] is not None:
+                meta = {**meta, **metadatas[n]} if merge else dict(metadatas[n])
+            if vecs is not None:
+                self._vectors[slot] = vecs[n]
+                self._norms[slot] = np.linalg.norm(vecs[n])
+            self._set_row(slot, rid, doc, meta)
+            rows.append((slot, rid, doc, json.dumps(meta)))
+            slots.append(slot)
+        if vecs is not None:
+            self._vectors.flush()
+            if self.quantization or self.binary:
+                self._encode(np.asarray(slots), vecs)
+        self._db.executemany("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?)", rows)
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None):
+        with self._lock:
+            if ids is not None:
+                slots = [self._index[i] for i in ids if i in self._index]
+                if where:
+                    mask = self._mask(where)
+                    slots = [s for s in slots if mask[s]]
+            else:
+                slots = np.flatnonzero(self._mask(where)).tolist() if where else []
+            for slot in slots:
+                del self._index[self._ids[slot]]
+                self._set_row(slot, None, None, None)
+                self._free.append(slot)
+            self._db.executemany("DELETE FROM records WHERE slot=?", [(s,) for s in slots])
+
+    # ---- reads ---------------------------------------------------------------
+
+    def count(self) -> int:
+        return len(self._index)
+
+    def _rows(self, slots: Iterable[int], include: List[str]) -> Dict:
+        slots = list(slots)
+        out = {"ids": [self._ids[s] for s in slots], "documents": None, "metadatas": None, "embeddings": None}
+        if "documents" in include:
+            out["documents"] = [self._docs[s] for s in slots]
+        if "metadatas" in include:
+            out["metadatas"] = [dict(self._metas[s] or {}) for s in slots]
+        if "embeddings" in include:
+            out["embeddings"] = np.array(self._vectors[slots]) if slots else np.zeros((0, self.dim or 0), np.float32)
+        return out
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None, limit: Optional[int] = None,
+            offset: int = 0, include: List[str] = ("documents", "metadatas")) -> Dict:
+        with self._lock:
+            if self.dim is None:
+                return self._rows([], include)
+            mask = self._mask(where)
+            if ids is not None:
+                slots = [self._index[i] for i in ids if i in self._index and mask[self._index[i]]]
+            else:
+                slots = np.flatnonzero(mask).tolist()
+            slots = slots[offset:offset + limit if limit is not None else None]
+            return self._rows(slots, include)
+
+    def query(self, query_embeddings, n_results: int = 10, where: Optional[Dict] = None,
+              include: List[str] = ("documents", "metadatas", "distances")) -> Dict:
+        with self._lock:
+            q = np.asarray(query_embeddings, dtype=np.float32).reshape(-1, self.dim or len(query_embeddings[0]))
+            keys = ("ids", "documents", "metadatas", "embeddings", "distances")
+            out = {k: [] for k in keys}
+            live = np.flatnonzero(self._mask(where)) if self.dim is not None else np.zeros(0, dtype=int)
+            if live.size == 0:
+                for k in keys:
+                    out[k] = [[] for _ in range(len(q))]
+                return out
+            k = min(int(n_results), live.size)
+            if self.quantization or self.binary:
+                # Approximate shortlist per query, then exact float32 rescoring
+                shortlists = self._shortlists(q, live, k)
+                dists = [self._distances(q[i:i + 1], cand)[0] for i, cand in enumerate(shortlists)]
+            else:
+                shortlists = [live] * len(q)
+                dists = self._distances(q, live)
+            for cand, row in zip(shortlists, dists):
+                top = np.argpartition(row, k - 1)[:k] if k < cand.size else np.arange(cand.size)
+                top = top[np.argsort(row[top], kind="stable")]
+                res = self._rows(cand[top].tolist(), include)
+                for key in ("ids", "documents", "metadatas", "embeddings"):
+                    out[key].append(res[key])
+                out["distances"].append(np.maximum(row[top], 0.0).tolist())
+            for key in ("documents", "metadatas", "embeddings", "distances"):
+                if key not in include:
+                    out[key] = None
+            return out
+
+    def _distances(self, q: np.ndarray, slots: np.ndarray) -> np.ndarray:
+        """Exact squared L2 from the float32 matrix (like Chroma's default space).
+        `slots` must be sorted; one matrix product covers every query."""
+        if slots.size > 64:
+            dots = (q @ self._vectors[:slots[-1] + 1].T)[:, slots]
+        else:
+            dots = q @ self._vectors[slots].T
+        return self._norms[slots] ** 2 + (q * q).sum(axis=1, keepdims=True) - 2.0 * dots
+
+    def _shortlists(self, q: np.ndarray, live: np.ndarray, k: int) -> List[np.ndarray]:
+        """Sorted candidate slots per query from the sign-bit and quantized copies."""
+        keep = k * self.rerank_factor
+        approx = None
+        if self.quantization and not self.binary and live.size > keep:
+            # One pass over the quantized matrix for all queries
+            approx = approx_dots(self._codes[:live[-1] + 1], self._scales[:live[-1] + 1], q)[:, live]
+        out = []
+        for i, qv in enumerate(q):
+            cand = live
+            prefilter = max(keep * PREFILTER_FACTOR, MIN_PREFILTER)
+            if self.binary and cand.size > prefilter:
+                ham = hamming(self._bits[cand], sign_bits(qv)[0])
+                cand = np.sort(cand[np.argpartition(ham, prefilter - 1)[:prefilter]])
+            if self.quantization and cand.size > keep:
+                scores = approx[i] if approx is not None else approx_dots(self._codes[cand], self._scales[cand], qv)[0]
+                cand = np.sort(cand[np.argpartition(-scores, keep - 1)[:keep]])
+            out.append(cand)
+        return out
+
+
+class NumpyClient:
+    """Stand-in for chromadb.PersistentClient over NumpyCollection directories."""
+
+    def __init__(self, path: Path, **collection_opts):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.collection_opts = collection_opts
+        self._collections: Dict[str, NumpyCollection] = {}
+        self._lock = threading.Lock()
+
+    def get_or_create_collection(self, name: str) -> NumpyCollection:
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = NumpyCollection(self.path / name, name, **self.collection_opts)
+            return self._collections[name]
+
+    create_collection = get_or_create_collection
+
+    def list_collections(self) -> List[str]:
+        """Names of the collections on disk (opened or not)."""
+        with self._lock:
+            return sorted(p.name for p in self.path.iterdir() if p.is_dir())
+
+    def delete_collection(self, name: str):
+        with self._lock:
+            col = self._collections.pop(name, None)
+            if col is not None:
+                col._db.close()
+                col._vectors = None
+            shutil.rmtree(self.path / name, ignore_errors=True)
@@ -0,0 +1,34 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from context import MIN_LINE_CHARS, ContextAssembler  # noqa: E402
+
+
+def test_lone_line_at_min_length_is_dropped_not_rebuilt():
+    assembler = ContextAssembler(budget=30)
+    assembler.add("question", ["q" * 80], priority=0, required=True)
+    assembler.add("earlier", ["s" * 400], priority=5, title="Earlier in this conversation:")
+    result = assembler.build()
+    assert assembler.sections["earlier"].lines == []
+    assert result["dropped"]["earlier"] >= 1
+
+
+def test_required_sections_over_budget_report_overflow():
+    assembler = ContextAssembler(budget=100)
+    assembler.add("persona", ["p" * 2000], priority=0, required=True)
+    assembler.add("question", ["u" * 3000], priority=0, required=True)
+    assembler.add("memory", ["m" * 200, "n" * 200], priority=4, title="Relevant memory:")
+    result = assembler.build()
+    assert assembler.sections["memory"].lines == []
+    assert result["overflow"] == result["tokens"] - 100 > 0
+    assert len(assembler.sections["question"].lines[0]) == 3000
+
+
+def test_shortened_line_stays_above_minimum():
+    assembler = ContextAssembler(budget=60)
+    assembler.add("memory", ["x" * 1000], priority=4, max_tokens=40)
+    assembler.build()
+    line = assembler.sections["memory"].lines[0]
+    assert MIN_LINE_CHARS < len(line) < 1000
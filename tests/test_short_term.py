@@ -0,0 +1,23 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from short_term import is_follow_up  # noqa: E402
+
+WINDOW = "user: walk me through the postgres migration assistant: It moves the tables in three phases."
+
+
+def test_anaphoric_messages_are_follow_ups():
+    assert is_follow_up("why?", WINDOW)
+    assert is_follow_up("and the second one?", WINDOW)
+    assert is_follow_up("what about the postgres tables?", WINDOW)
+
+
+def test_new_topic_is_not_a_follow_up():
+    assert not is_follow_up("what about the kubernetes deployment?", WINDOW)
+    assert not is_follow_up("so how do I configure nginx for that", WINDOW)
+
+
+def test_content_words_need_a_window():
+    assert not is_follow_up("what about the postgres tables?")